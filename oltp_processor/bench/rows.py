@@ -0,0 +1,53 @@
+"""Генератор синтетических событий для бенчмарков"""
+
+import datetime as dt
+import decimal
+import random
+import sys
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import data_types  # noqa: E402
+
+_BRANDS = ["samsung", "apple", "xiaomi", "huawei", "lucente", "", "cordiant"]
+_CATEGORIES = [
+    ("2053013555631882655", "electronics.smartphone"),
+    ("2053013554658804075", "electronics.audio.headphone"),
+    ("2053013558920217191", "computers.notebook"),
+    ("2053013565983425517", "appliances.environment.water_heater"),
+    ("2053013561579406073", ""),
+]
+_WEIGHTS = {"view": 90, "cart": 5, "remove_from_cart": 3, "purchase": 2}
+
+
+def random_rows(
+    n: int,
+    seed: int = 42,
+    users: int = 10_000,
+    products: int = 5_000,
+    start: dt.datetime = dt.datetime(2019, 10, 1, tzinfo=dt.timezone.utc),
+    span: dt.timedelta = dt.timedelta(days=1),
+) -> list[data_types.DatasetRow]:
+    rnd = random.Random(seed)
+    event_types = rnd.choices(list(_WEIGHTS), weights=list(_WEIGHTS.values()), k=n)
+    seconds = sorted(rnd.uniform(0, span.total_seconds()) for _ in range(n))
+    rows = []
+    for event_type, second in zip(event_types, seconds):
+        category_id, category_code = rnd.choice(_CATEGORIES)
+        rows.append(
+            data_types.DatasetRow(
+                event_time=start + dt.timedelta(seconds=round(second, 6)),
+                event_type=event_type,
+                product_id=rnd.randrange(1_000_000, 1_000_000 + products),
+                category_id=category_id,
+                category_code=category_code,
+                brand=rnd.choice(_BRANDS),
+                price=decimal.Decimal(rnd.randrange(100, 500_000)).scaleb(-2),
+                user_id=rnd.randrange(500_000_000, 500_000_000 + users),
+                user_session=uuid.UUID(int=rnd.getrandbits(128), version=4),
+                row_id=uuid.UUID(int=rnd.getrandbits(128), version=4),
+            )
+        )
+    return rows
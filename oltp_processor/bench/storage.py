@@ -0,0 +1,149 @@
+"""Сравнение старой и новой раскладки event: байты на строку и range-запросы
+
+Создает отдельную схему, заливает одинаковые синтетические строки в обе
+раскладки и в конце схему удаляет.
+
+    python bench/storage.py -n 1000000
+"""
+
+import asyncio
+import time
+
+import click
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from rows import random_rows
+
+import config
+import data_types
+
+SCHEMA = "bench_storage"
+CHUNK = 5_000
+
+DDL = {
+    "old": [
+        """
+        CREATE TABLE {schema}.old (
+            id uuid PRIMARY KEY,
+            event_type varchar(50) NOT NULL,
+            event_time timestamptz NOT NULL,
+            product_id bigint NOT NULL,
+            user_id bigint NOT NULL,
+            user_session uuid NOT NULL,
+            price numeric(10, 2) NOT NULL,
+            created_at timestamptz NOT NULL DEFAULT now()
+        )
+        """,
+    ],
+    "new": [
+        """
+        CREATE TABLE {schema}.new (
+            event_time timestamptz NOT NULL,
+            product_id bigint NOT NULL,
+            user_id bigint NOT NULL,
+            id uuid PRIMARY KEY,
+            user_session uuid NOT NULL,
+            event_type_id smallint NOT NULL,
+            price numeric(10, 2) NOT NULL
+        )
+        """,
+        "CREATE INDEX ON {schema}.new USING brin (event_time)",
+        "CREATE INDEX ON {schema}.new (user_id, event_time)",
+    ],
+}
+
+QUERIES = {
+    "1h range": (
+        "SELECT count(*), sum(price) FROM {table} "
+        "WHERE event_time >= :start AND event_time < :start + interval '1 hour'"
+    ),
+    "user 6h": (
+        "SELECT count(*) FROM {table} WHERE user_id = :user_id "
+        "AND event_time >= :start AND event_time < :start + interval '6 hours'"
+    ),
+}
+
+
+def to_params(row: data_types.DatasetRow) -> dict:
+    return {
+        "id": row.row_id,
+        "event_type": row.event_type,
+        "event_type_id": data_types.EVENT_TYPES.index(row.event_type) + 1,
+        "event_time": row.event_time,
+        "product_id": row.product_id,
+        "user_id": row.user_id,
+        "user_session": row.user_session,
+        "price": row.price,
+    }
+
+
+async def run(count: int, repeat: int):
+    engine = create_async_engine(
+        config.build_pg_url(), isolation_level="AUTOCOMMIT", echo=False
+    )
+    rows = [to_params(r) for r in random_rows(count)]
+    inserts = {
+        "old": (
+            "INSERT INTO {schema}.old (id, event_type, event_time, product_id, "
+            "user_id, user_session, price) VALUES (:id, :event_type, :event_time, "
+            ":product_id, :user_id, :user_session, :price)"
+        ),
+        "new": (
+            "INSERT INTO {schema}.new (event_time, product_id, user_id, id, "
+            "user_session, event_type_id, price) VALUES (:event_time, :product_id, "
+            ":user_id, :id, :user_session, :event_type_id, :price)"
+        ),
+    }
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+            for layout, statements in DDL.items():
+                for stmt in statements:
+                    await conn.execute(text(stmt.format(schema=SCHEMA)))
+
+            for layout, stmt in inserts.items():
+                started = time.perf_counter()
+                insert = text(stmt.format(schema=SCHEMA))
+                for i in range(0, count, CHUNK):
+                    await conn.execute(insert, rows[i : i + CHUNK])
+                elapsed = time.perf_counter() - started
+                await conn.execute(text(f"VACUUM ANALYZE {SCHEMA}.{layout}"))
+                result = await conn.execute(
+                    text("SELECT pg_table_size(:t), pg_indexes_size(:t)"),
+                    {"t": f"{SCHEMA}.{layout}"},
+                )
+                table_size, index_size = result.one()
+                click.echo(
+                    f"{layout}: insert {count / elapsed:9.0f} rows/s, "
+                    f"heap {table_size / count:6.1f} B/row, "
+                    f"indexes {index_size / count:6.1f} B/row"
+                )
+
+            start = rows[count // 2]["event_time"].replace(minute=0, second=0)
+            params = {"start": start, "user_id": rows[count // 2]["user_id"]}
+            for name, query in QUERIES.items():
+                for layout in DDL:
+                    stmt = text(query.format(table=f"{SCHEMA}.{layout}"))
+                    await conn.execute(stmt, params)  # прогрев
+                    started = time.perf_counter()
+                    for _ in range(repeat):
+                        await conn.execute(stmt, params)
+                    elapsed = (time.perf_counter() - started) / repeat
+                    click.echo(f"{name:>9} {layout}: {elapsed * 1e3:8.2f} ms")
+    finally:
+        async with engine.connect() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+
+
+@click.command()
+@click.option("-n", "count", type=int, default=1_000_000, help="Number of rows")
+@click.option("--repeat", type=int, default=20, help="Query repetitions")
+def main(count: int, repeat: int):
+    asyncio.run(run(count, repeat))
+
+
+if __name__ == "__main__":
+    main()
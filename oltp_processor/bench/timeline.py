@@ -0,0 +1,185 @@
+"""Лента пользователя: UNION с OFFSET против пагинации по ключу
+
+Создает две отдельные схемы с одинаковыми синтетическими event и purchase:
+old - с индексами (user_id, event_time) до миграции e5b8c2d4f716, new - с
+покрывающими индексами ленты. OFFSET меряется на old, keyset (тот же
+timeline_query, что и в сервисе) - на new. В конце схемы удаляются, таблицы
+настроенной БД не трогаются.
+
+    python bench/timeline.py -n 1000000 --users 100 --pages 20
+"""
+
+import asyncio
+import time
+
+import click
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from rows import random_rows
+
+import config
+import data_types
+import timeline
+
+PURCHASE = data_types.EVENT_TYPES.index("purchase") + 1
+SCHEMAS = {"old": "bench_timeline_old", "new": "bench_timeline_new"}
+CHUNK = 5_000
+
+TABLES = [
+    """
+    CREATE TABLE {schema}.event (
+        event_time timestamptz NOT NULL,
+        product_id bigint NOT NULL,
+        user_id bigint NOT NULL,
+        id uuid PRIMARY KEY,
+        user_session uuid NOT NULL,
+        event_type_id smallint NOT NULL,
+        price numeric(10, 2) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE {schema}.purchase (
+        id uuid PRIMARY KEY,
+        event_time timestamptz NOT NULL,
+        product_id bigint NOT NULL,
+        user_id bigint NOT NULL,
+        user_session uuid NOT NULL,
+        price numeric(10, 2) NOT NULL
+    )
+    """,
+]
+
+INDEXES = {
+    "old": [
+        "CREATE INDEX ON {schema}.event (user_id, event_time)",
+        "CREATE INDEX ON {schema}.purchase (user_id, event_time)",
+    ],
+    "new": [
+        "CREATE INDEX ON {schema}.event (user_id, event_time, id) "
+        "INCLUDE (event_type_id, product_id, price, user_session)",
+        "CREATE INDEX ON {schema}.purchase (user_id, event_time, id) "
+        "INCLUDE (product_id, price, user_session)",
+    ],
+}
+
+INSERTS = {
+    "event": (
+        "INSERT INTO {schema}.event (event_time, product_id, user_id, id, "
+        "user_session, event_type_id, price) VALUES (:event_time, :product_id, "
+        ":user_id, :id, :user_session, :event_type_id, :price)"
+    ),
+    "purchase": (
+        "INSERT INTO {schema}.purchase (id, event_time, product_id, user_id, "
+        "user_session, price) VALUES (:id, :event_time, :product_id, :user_id, "
+        ":user_session, :price)"
+    ),
+}
+
+OFFSET_QUERY = """
+    SELECT event_time, id FROM (
+        SELECT event_time, id FROM {schema}.event WHERE user_id = :user_id
+        UNION ALL
+        SELECT event_time, id FROM {schema}.purchase WHERE user_id = :user_id
+    ) t
+    ORDER BY event_time DESC, id DESC
+    LIMIT :limit OFFSET :offset
+    """
+
+
+def to_params(row: data_types.DatasetRow) -> dict:
+    return {
+        "id": row.row_id,
+        "event_type_id": data_types.EVENT_TYPES.index(row.event_type) + 1,
+        "event_time": row.event_time,
+        "product_id": row.product_id,
+        "user_id": row.user_id,
+        "user_session": row.user_session,
+        "price": row.price,
+    }
+
+
+async def load(conn, schema: str, layout: str, rows: list[dict]):
+    for stmt in TABLES + INDEXES[layout]:
+        await conn.execute(text(stmt.format(schema=schema)))
+    tables = {
+        "event": [r for r in rows if r["event_type_id"] != PURCHASE],
+        "purchase": [r for r in rows if r["event_type_id"] == PURCHASE],
+    }
+    for table, table_rows in tables.items():
+        insert = text(INSERTS[table].format(schema=schema))
+        for i in range(0, len(table_rows), CHUNK):
+            await conn.execute(insert, table_rows[i : i + CHUNK])
+        await conn.execute(text(f"VACUUM ANALYZE {schema}.{table}"))
+
+
+async def run(count: int, users: int, pages: int, page_size: int):
+    engine = create_async_engine(
+        config.build_pg_url(), isolation_level="AUTOCOMMIT", echo=False
+    )
+    rows = [to_params(r) for r in random_rows(count, users=users)]
+    user_ids = sorted({r["user_id"] for r in rows})
+    try:
+        async with engine.connect() as conn:
+            for layout, schema in SCHEMAS.items():
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+                await conn.execute(text(f"CREATE SCHEMA {schema}"))
+                await load(conn, schema, layout, rows)
+
+            offset_times = [0.0] * pages
+            offset_query = text(OFFSET_QUERY.format(schema=SCHEMAS["old"]))
+            for user_id in user_ids:
+                for page in range(pages):
+                    started = time.perf_counter()
+                    await conn.execute(
+                        offset_query,
+                        {
+                            "user_id": user_id,
+                            "limit": page_size,
+                            "offset": page * page_size,
+                        },
+                    )
+                    offset_times[page] += time.perf_counter() - started
+
+            # Модели без схемы: запросы сервиса уходят в схему new
+            new = await conn.execution_options(
+                schema_translate_map={None: SCHEMAS["new"]}
+            )
+            keyset_times = [0.0] * pages
+            for user_id in user_ids:
+                cursor = None
+                for page in range(pages):
+                    started = time.perf_counter()
+                    result = await new.execute(
+                        timeline.timeline_query(user_id, page_size, cursor)
+                    )
+                    entries = result.all()
+                    keyset_times[page] += time.perf_counter() - started
+                    if len(entries) < page_size:
+                        break
+                    cursor = entries[-1].event_time, entries[-1].id
+
+        click.echo(f"{'page':>5} {'offset, ms':>11} {'keyset, ms':>11}")
+        for page in range(pages):
+            click.echo(
+                f"{page:>5} {offset_times[page] * 1e3 / len(user_ids):11.2f} "
+                f"{keyset_times[page] * 1e3 / len(user_ids):11.2f}"
+            )
+    finally:
+        async with engine.connect() as conn:
+            for schema in SCHEMAS.values():
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        await engine.dispose()
+
+
+@click.command()
+@click.option("-n", "count", type=int, default=1_000_000, help="Number of rows")
+@click.option("--users", type=int, default=100, help="Number of users")
+@click.option("--pages", type=int, default=20, help="Pages per user")
+@click.option("--page-size", type=int, default=50, help="Entries per page")
+def main(count: int, users: int, pages: int, page_size: int):
+    asyncio.run(run(count, users, pages, page_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""Сравнение размера и скорости разбора JSON и бинарного формата
+
+python bench/wire_format.py -n 100000
+"""
+
+import time
+
+import click
+
+from rows import random_rows
+
+import wire
+
+
+@click.command()
+@click.option("-n", "count", type=int, default=100_000, help="Number of rows")
+def main(count: int):
+    rows = random_rows(count)
+    for fmt in (wire.FORMAT_JSON, wire.FORMAT_STRUCT):
+        payloads = [wire.encode(r, fmt) for r in rows]
+        total = sum(len(p) for p in payloads)
+
+        started = time.perf_counter()
+        decoded = [wire.decode(p, fmt) for p in payloads]
+        elapsed = time.perf_counter() - started
+
+        assert decoded == rows, f"{fmt} roundtrip mismatch"
+        click.echo(
+            f"{fmt:>8}: {total / count:7.1f} bytes/row, "
+            f"decode {elapsed * 1e6 / count:6.2f} us/row"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ from sqlalchemy.ext.asyncio import async_engine_from_config
 from models import Base
 from alembic import context
 
-from config import build_pg_url
+from config import build_shard_urls
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -23,7 +23,9 @@ if config.config_file_name is not None:
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
-config.set_main_option("sqlalchemy.url", build_pg_url())
+# миграция конкретного шарда: alembic -x shard=1 upgrade head
+shard = int(context.get_x_argument(as_dictionary=True).get("shard", 0))
+config.set_main_option("sqlalchemy.url", build_shard_urls()[shard])
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
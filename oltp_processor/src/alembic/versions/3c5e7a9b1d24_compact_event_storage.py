@@ -0,0 +1,145 @@
+"""compact event storage
+
+Revision ID: 3c5e7a9b1d24
+Revises: 681bef7f2ec0
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "3c5e7a9b1d24"
+down_revision: Union[str, Sequence[str], None] = "681bef7f2ec0"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+EVENT_TYPES = ("view", "cart", "remove_from_cart", "purchase")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    event_type = op.create_table(
+        "event_type",
+        sa.Column(
+            "event_type_id", sa.SmallInteger(), autoincrement=True, nullable=False
+        ),
+        sa.Column("event_type_name", sa.String(length=50), nullable=False),
+        sa.PrimaryKeyConstraint("event_type_id"),
+        sa.UniqueConstraint("event_type_name"),
+    )
+    op.bulk_insert(event_type, [{"event_type_name": name} for name in EVENT_TYPES])
+    # типы, которые могли прийти в json помимо известных
+    op.execute(
+        "INSERT INTO event_type (event_type_name) "
+        "SELECT DISTINCT event_type FROM event ON CONFLICT DO NOTHING"
+    )
+
+    # Колонки в event нельзя переставить на месте, поэтому пересоздаем таблицу
+    op.rename_table("event", "event_old")
+    op.execute("ALTER INDEX event_pkey RENAME TO event_old_pkey")
+    op.create_table(
+        "event",
+        sa.Column("event_time", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("product_id", sa.BigInteger(), nullable=False),
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("user_session", sa.UUID(), nullable=False),
+        sa.Column("event_type_id", sa.SmallInteger(), nullable=False),
+        sa.Column("price", sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["event_type_id"],
+            ["event_type.event_type_id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["product_id"],
+            ["product.product_id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["user.user_id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.execute("""
+        INSERT INTO event
+            (event_time, product_id, user_id, id, user_session, event_type_id, price)
+        SELECT e.event_time, e.product_id, e.user_id, e.id, e.user_session,
+               t.event_type_id, e.price
+        FROM event_old e
+        JOIN event_type t ON t.event_type_name = e.event_type
+        ORDER BY e.event_time
+        """)
+    op.drop_table("event_old")
+
+    op.drop_column("purchase", "created_at")
+
+    op.create_index(
+        "ix_event_event_time_brin", "event", ["event_time"], postgresql_using="brin"
+    )
+    op.create_index("ix_event_user_id_event_time", "event", ["user_id", "event_time"])
+    op.create_index(
+        "ix_purchase_event_time_brin",
+        "purchase",
+        ["event_time"],
+        postgresql_using="brin",
+    )
+    op.create_index(
+        "ix_purchase_user_id_event_time", "purchase", ["user_id", "event_time"]
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_purchase_user_id_event_time", table_name="purchase")
+    op.drop_index("ix_purchase_event_time_brin", table_name="purchase")
+    op.add_column(
+        "purchase",
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+    )
+
+    op.rename_table("event", "event_new")
+    op.execute("ALTER INDEX event_pkey RENAME TO event_new_pkey")
+    op.create_table(
+        "event",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("event_type", sa.String(length=50), nullable=False),
+        sa.Column("event_time", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("product_id", sa.BigInteger(), nullable=False),
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("user_session", sa.UUID(), nullable=False),
+        sa.Column("price", sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(
+            ["product_id"],
+            ["product.product_id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["user.user_id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.execute("""
+        INSERT INTO event
+            (id, event_type, event_time, product_id, user_id, user_session, price)
+        SELECT e.id, t.event_type_name, e.event_time, e.product_id, e.user_id,
+               e.user_session, e.price
+        FROM event_new e
+        JOIN event_type t ON t.event_type_id = e.event_type_id
+        """)
+    op.drop_table("event_new")
+    op.drop_table("event_type")
@@ -0,0 +1,85 @@
+"""daily rollups
+
+Revision ID: 8f2a4c6e0b13
+Revises: 3c5e7a9b1d24
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "8f2a4c6e0b13"
+down_revision: Union[str, Sequence[str], None] = "3c5e7a9b1d24"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Категория и бренд у событий берутся из product, как они есть на момент миграции
+FACTS = """
+    SELECT e.event_time, e.event_type_id, e.product_id FROM event e
+    UNION ALL
+    SELECT p.event_time, t.event_type_id, p.product_id FROM purchase p
+    JOIN event_type t ON t.event_type_name = 'purchase'
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "daily_category_stats",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("event_type_id", sa.SmallInteger(), nullable=False),
+        sa.Column("category_id", sa.String(length=256), nullable=False),
+        sa.Column("cnt", sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["category_id"],
+            ["category.category_id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["event_type_id"],
+            ["event_type.event_type_id"],
+        ),
+        sa.PrimaryKeyConstraint("day", "event_type_id", "category_id"),
+    )
+    op.create_table(
+        "daily_brand_stats",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("event_type_id", sa.SmallInteger(), nullable=False),
+        sa.Column("brand_id", sa.Integer(), nullable=False),
+        sa.Column("cnt", sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["brand_id"],
+            ["brand.brand_id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["event_type_id"],
+            ["event_type.event_type_id"],
+        ),
+        sa.PrimaryKeyConstraint("day", "event_type_id", "brand_id"),
+    )
+    op.execute(f"""
+        INSERT INTO daily_category_stats (day, event_type_id, category_id, cnt)
+        SELECT (f.event_time AT TIME ZONE 'UTC')::date, f.event_type_id,
+               pr.category_id, count(*)
+        FROM ({FACTS}) f
+        JOIN product pr ON pr.product_id = f.product_id
+        GROUP BY 1, 2, 3
+        """)
+    op.execute(f"""
+        INSERT INTO daily_brand_stats (day, event_type_id, brand_id, cnt)
+        SELECT (f.event_time AT TIME ZONE 'UTC')::date, f.event_type_id,
+               pr.brand_id, count(*)
+        FROM ({FACTS}) f
+        JOIN product pr ON pr.product_id = f.product_id
+        WHERE pr.brand_id IS NOT NULL
+        GROUP BY 1, 2, 3
+        """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("daily_brand_stats")
+    op.drop_table("daily_category_stats")
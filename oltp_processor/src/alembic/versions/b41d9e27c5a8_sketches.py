@@ -0,0 +1,57 @@
+"""sketches
+
+Revision ID: b41d9e27c5a8
+Revises: 8f2a4c6e0b13
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "b41d9e27c5a8"
+down_revision: Union[str, Sequence[str], None] = "8f2a4c6e0b13"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "category_users_sketch",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("category_id", sa.String(length=256), nullable=False),
+        sa.Column("sketch", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["category_id"],
+            ["category.category_id"],
+        ),
+        sa.PrimaryKeyConstraint("day", "category_id"),
+    )
+    op.create_table(
+        "brand_users_sketch",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("brand_id", sa.Integer(), nullable=False),
+        sa.Column("sketch", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["brand_id"],
+            ["brand.brand_id"],
+        ),
+        sa.PrimaryKeyConstraint("day", "brand_id"),
+    )
+    op.create_table(
+        "hot_products_sketch",
+        sa.Column("hour", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("sketch", sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint("hour"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("hot_products_sketch")
+    op.drop_table("brand_users_sketch")
+    op.drop_table("category_users_sketch")
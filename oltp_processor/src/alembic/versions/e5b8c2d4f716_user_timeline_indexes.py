@@ -0,0 +1,59 @@
+"""user timeline indexes
+
+Revision ID: e5b8c2d4f716
+Revises: d7e3f1a6b902
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "e5b8c2d4f716"
+down_revision: Union[str, Sequence[str], None] = "d7e3f1a6b902"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Индексы по большим таблицам строим без блокировки записи
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_event_user_timeline",
+            "event",
+            ["user_id", "event_time", "id"],
+            postgresql_include=["event_type_id", "product_id", "price", "user_session"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_purchase_user_timeline",
+            "purchase",
+            ["user_id", "event_time", "id"],
+            postgresql_include=["product_id", "price", "user_session"],
+            postgresql_concurrently=True,
+        )
+        # (user_id, event_time) - префикс новых индексов
+        op.drop_index(
+            "ix_event_user_id_event_time",
+            table_name="event",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_purchase_user_id_event_time",
+            table_name="purchase",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index("ix_event_user_id_event_time", "event", ["user_id", "event_time"])
+    op.create_index(
+        "ix_purchase_user_id_event_time", "purchase", ["user_id", "event_time"]
+    )
+    op.drop_index("ix_purchase_user_timeline", table_name="purchase")
+    op.drop_index("ix_event_user_timeline", table_name="event")
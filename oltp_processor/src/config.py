@@ -13,9 +13,9 @@ def load_config(config_path=None):
         return yaml.safe_load(f)
 
 
-def build_pg_url():
-    cfg = load_config()
-    pg_cfg = cfg.get("postgres")
+def build_pg_url(pg_cfg=None):
+    if pg_cfg is None:
+        pg_cfg = load_config().get("postgres")
     user = pg_cfg.get("user")
     password = pg_cfg.get("password")
     host = pg_cfg.get("host")
@@ -24,3 +24,10 @@ def build_pg_url():
     url = f"postgresql+asyncpg://{user}:{password}@{host}:{port}/{dbname}"
     print(url)
     return url
+
+
+def build_shard_urls():
+    """Урлы шардов из секции shards, без нее - единственный основной postgres"""
+    cfg = load_config()
+    shards = cfg.get("shards") or [cfg.get("postgres")]
+    return [build_pg_url(shard) for shard in shards]
@@ -1,12 +1,24 @@
 import asyncio
+import datetime as dt
 import logging
+import signal
+import sys
+from pathlib import Path
 
 from aiokafka import AIOKafkaConsumer
 
+import cooccurrence
 import db
+import profiler
+import sharding
+import spool
+import wire
 
 logger = logging.getLogger(__name__)
 
+# Накладные расходы питона на одно сообщение в батче: кортеж и объект bytes
+MESSAGE_OVERHEAD = sys.getsizeof((None, None)) + sys.getsizeof(b"")
+
 
 class KafkaConsumer:
     def __init__(
@@ -19,6 +31,16 @@ class KafkaConsumer:
         batch_timeout: float = 5.0,
         read_timeout: int = 1000,
         database_url: str | None = None,
+        profile_dir: str = "profiles",
+        profile_seconds: float | None = None,
+        slow_batch_ms: float | None = None,
+        spool_dir: str | None = None,
+        spool_latency: float = 10.0,
+        spool_errors: int = 3,
+        max_spool_bytes: int = 1024 * 1024 * 1024,
+        dead_letter_errors: int = 5,
+        max_buffer_bytes: int = 64 * 1024 * 1024,
+        cooccurrence_interval: float | None = None,
     ):
         self.host = host
         self.port = port
@@ -28,10 +50,52 @@ class KafkaConsumer:
         self.batch_timeout = batch_timeout
         self.read_timeout = read_timeout
 
+        # Бюджет памяти на накопленный батч: при превышении ставим партиции
+        # на паузу, пока батч не запишется. После неудачной записи паузу
+        # ставим сразу, чтобы ретраи шли батчем исходного размера
+        self.max_buffer_bytes = max_buffer_bytes
+        self.buffered_bytes = 0
+        self.write_failed = False
+        self.paused = False
+
         self.consumer = None
         self.db_processor = None
         self.db_url = database_url
 
+        # Профайлер запускается сразу на profile_seconds, если они заданы,
+        # и в любой момент по SIGUSR1
+        self.profiler = profiler.SamplingProfiler(profile_dir)
+        self.profile_seconds = profile_seconds
+        self.slow_batch_ms = slow_batch_ms
+
+        # Спул включается, если задана папка: батч уходит на диск, если запись
+        # в БД дольше spool_latency секунд или упала spool_errors раз подряд.
+        # Больше max_spool_bytes не спулим, а ждем дренер. Батч, который БД
+        # отвергла dead_letter_errors раз подряд не из-за сбоя, дренер
+        # откладывает в dead/, иначе спул так и не освободится
+        self.spool_dir = spool_dir
+        self.spool_latency = spool_latency
+        self.spool_errors = spool_errors
+        self.max_spool_bytes = max_spool_bytes
+        self.dead_letter_errors = dead_letter_errors
+        self.spool = None
+        self.drainer = None
+        self.drain_processor = None
+        self.failed_writes = 0
+
+        # Индексы "смотрят вместе"/"покупают вместе", сбрасываются в БД
+        # раз в cooccurrence_interval секунд или раньше, если копится слишком
+        # много приростов
+        self.cooccurrence_interval = cooccurrence_interval
+        self.cooccurrence = []
+        if cooccurrence_interval:
+            self.cooccurrence = [
+                cooccurrence.CooccurrenceIndex("viewed", {"view", "cart"}),
+                cooccurrence.CooccurrenceIndex("bought", {"purchase"}),
+            ]
+        self.flusher = None
+        self.flush_requested = asyncio.Event()
+
     async def start(self):
         """Инициализация консьюмера и БД"""
         logger.info(
@@ -46,12 +110,30 @@ class KafkaConsumer:
             auto_offset_reset="earliest",
             enable_auto_commit=False,  # Ручной коммит после успешной вставки
             max_poll_records=self.batch_size,  # Получаем сразу батч
+            # Префетч клиента тоже держит сообщения в памяти
+            fetch_max_bytes=min(self.max_buffer_bytes, 50 * 1024 * 1024),
         )
-        self.db_processor = db.DBProcessor(self.db_url)
+        self.db_processor = sharding.create_processor(self.db_url, self.batch_size)
+        if self.spool_dir:
+            self.spool = spool.Spool(self.spool_dir)
+            # У дренера свой пул, чтобы не мешать основной записи
+            self.drain_processor = sharding.create_processor(
+                self.db_url, self.batch_size
+            )
+            self.drainer = asyncio.create_task(self._drain())
+
+        if self.cooccurrence:
+            self.flusher = asyncio.create_task(self._flush_cooccurrence())
 
         await self.consumer.start()
         logger.info("Kafka consumer started successfully")
 
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGUSR1, self.profiler.start, self.profile_seconds or 30
+        )
+        if self.profile_seconds:
+            self.profiler.start(self.profile_seconds)
+
     async def stop(self):
         """Остановка консьюмера и закрытие БД"""
         logger.info("Stopping Kafka consumer...")
@@ -59,22 +141,59 @@ class KafkaConsumer:
         if self.consumer:
             await self.consumer.stop()
 
+        if self.flusher:
+            self.flusher.cancel()
+            await asyncio.gather(self.flusher, return_exceptions=True)
+            await self._flush_cooccurrence_once()
+
+        if self.drainer:
+            self.drainer.cancel()
+            await asyncio.gather(self.drainer, return_exceptions=True)
+            await self.drain_processor.close()
+        if self.spool:
+            self.spool.close()
+            if self.spool.pending:
+                logger.warning(f"Spool depth on stop: {self.spool.depth} bytes")
+
         await self.db_processor.close()
         logger.info("Kafka consumer stopped")
 
     def should_insert(self, batch, time_elapsed):
-        return len(batch) >= self.batch_size or (
-            batch and time_elapsed >= self.batch_timeout
+        return (
+            len(batch) >= self.batch_size
+            or self.buffered_bytes >= self.max_buffer_bytes
+            or (batch and time_elapsed >= self.batch_timeout)
         )
 
+    def update_flow_control(self):
+        """Пауза/возобновление чтения по заполненности буфера и ошибкам записи"""
+        if self.write_failed or self.buffered_bytes >= self.max_buffer_bytes:
+            # На каждой итерации: после ребаланса могли прийти новые партиции
+            self.consumer.pause(*self.consumer.assignment())
+            if not self.paused:
+                reason = (
+                    "Batch write failed"
+                    if self.write_failed
+                    else f"Buffer is full ({self.buffered_bytes} bytes)"
+                )
+                logger.warning(f"{reason}, pausing fetch")
+                self.paused = True
+        elif self.paused:
+            self.consumer.resume(*self.consumer.assignment())
+            self.paused = False
+            logger.info("Batch is written, resuming fetch")
+
     async def get_batch(self):
+        # На паузе getmany ничего не вернет, но подождет read_timeout
+        # и сообщит группе, что консьюмер жив
         data = await self.consumer.getmany(
             timeout_ms=self.read_timeout, max_records=self.batch_size
         )
         batch = []
         for messages in data.values():
             for msg in messages:
-                batch.append(msg.value.decode("utf-8"))
+                batch.append((wire.message_format(msg.headers), msg.value))
+                self.buffered_bytes += len(msg.value) + MESSAGE_OVERHEAD
         return batch
 
     async def consume(self):
@@ -84,14 +203,22 @@ class KafkaConsumer:
         try:
             while True:
                 try:
+                    self.update_flow_control()
                     new_messages = await self.get_batch()
                     batch.extend(new_messages)
                     current_time = asyncio.get_event_loop().time()
                     time_elapsed = current_time - last_batch_time
 
                     if self.should_insert(batch, time_elapsed):
-                        await self._process_batch(batch)
+                        try:
+                            await self._write_batch(batch)
+                        except Exception:
+                            # Не копим сообщения, пока батч не запишется
+                            self.write_failed = True
+                            raise
+                        self.write_failed = False
                         batch = []
+                        self.buffered_bytes = 0
                         last_batch_time = current_time
 
                         # Коммитим оффсеты после успешной вставки
@@ -105,10 +232,90 @@ class KafkaConsumer:
         finally:
             # Обрабатываем оставшиеся сообщения при остановке
             if batch:
-                await self._process_batch(batch)
+                await self._write_batch(batch)
                 await self.consumer.commit()
 
-    async def _process_batch(self, batch: list[str]):
+    async def _write_batch(self, batch: list[tuple[str, bytes]]):
+        """Пишет батч в БД или в спул; после возврата оффсеты можно коммитить"""
+        if self.spool is None:
+            await self._process_batch(batch)
+            return
+        if self.spool.pending:
+            # Пока дренер не догнал, новые батчи тоже идут в спул
+            await self._spool_batch(batch)
+            return
+        try:
+            await asyncio.wait_for(self._process_batch(batch), self.spool_latency)
+            self.failed_writes = 0
+        except TimeoutError:
+            logger.warning(f"DB write took longer than {self.spool_latency}s")
+            self._report_slow_batch(self.db_processor.last_timings)
+            await self._spool_batch(batch)
+        except Exception:
+            self.failed_writes += 1
+            if self.failed_writes < self.spool_errors:
+                raise
+            await self._spool_batch(batch)
+
+    async def _spool_batch(self, batch: list[tuple[str, bytes]]):
+        depth = self.spool.depth
+        if depth >= self.max_spool_bytes:
+            # Исключение оставит батч в памяти и поставит чтение на паузу
+            logger.error(f"Spool is full ({depth} bytes), waiting for the drainer")
+            raise RuntimeError("Spool is full")
+        await self.spool.append(batch)
+        logger.warning(
+            f"Spooled batch of {len(batch)} messages, "
+            f"spool depth {self.spool.depth} bytes"
+        )
+
+    async def _drain(self, interval: float = 1.0):
+        """Дозаливает спул в БД, как только она снова доступна"""
+        # Сколько батчей текущего сегмента уже записано и сколько раз подряд
+        # БД отвергла следующий
+        segment, done, errors = None, 0, 0
+        while True:
+            next_segment = await self.spool.next_segment()
+            if next_segment is None:
+                await asyncio.sleep(interval)
+                continue
+            if next_segment != segment:
+                segment, done, errors = next_segment, 0, 0
+            try:
+                for i, batch in enumerate(self.spool.read(segment)):
+                    if i < done:
+                        continue
+                    await self._drain_batch(segment, batch, errors)
+                    done, errors = i + 1, 0
+                self.spool.remove(segment)
+                self.failed_writes = 0
+                logger.info(
+                    f"Drained spool segment {segment.name}, "
+                    f"spool depth {self.spool.depth} bytes"
+                )
+            except Exception as e:
+                if not db.is_transient_error(e):
+                    errors += 1
+                logger.error(f"Failed to drain spool: {e}")
+                await asyncio.sleep(interval)
+
+    async def _drain_batch(
+        self, segment: Path, batch: list[tuple[str, bytes]], errors: int
+    ):
+        try:
+            await self.drain_processor.insert_batch(batch)
+        except Exception as e:
+            if db.is_transient_error(e) or errors + 1 < self.dead_letter_errors:
+                raise
+            path = await self.spool.dead_letter(segment, batch)
+            logger.error(
+                f"Dead-lettered batch of {len(batch)} messages to {path} "
+                f"after {errors + 1} errors: {e}"
+            )
+            return
+        self._update_cooccurrence(self.drain_processor.last_records)
+
+    async def _process_batch(self, batch: list[tuple[str, bytes]]):
         if not batch:
             return
         logger.info(f"Processing batch of {len(batch)} messages")
@@ -121,11 +328,51 @@ class KafkaConsumer:
                 )
             else:
                 logger.info(f"Batch processed successfully: {success} records")
+            self._report_slow_batch(self.db_processor.last_timings)
+            self._update_cooccurrence(self.db_processor.last_records)
 
         except Exception as e:
             logger.error(f"Failed to process batch: {e}", exc_info=True)
             raise
 
+    def _update_cooccurrence(self, records):
+        for index in self.cooccurrence:
+            index.update(records)
+            if index.full:
+                self.flush_requested.set()
+
+    async def _flush_cooccurrence_once(self):
+        try:
+            async with self.db_processor.async_session() as session:
+                for index in self.cooccurrence:
+                    await index.flush(session)
+        except Exception as e:
+            # Несброшенные приросты остаются в памяти до следующего сброса
+            logger.error(f"Failed to flush product co-occurrence: {e}")
+
+    async def _flush_cooccurrence(self):
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self.flush_requested.wait(), self.cooccurrence_interval
+                )
+            except TimeoutError:
+                pass
+            self.flush_requested.clear()
+            await self._flush_cooccurrence_once()
+
+    def _report_slow_batch(self, timings: profiler.BatchTimings | None):
+        if self.slow_batch_ms is None or timings is None:
+            return
+        if timings.total * 1e3 < self.slow_batch_ms:
+            return
+        report = timings.report()
+        logger.warning(report)
+        path = Path(self.profiler.output_dir)
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / "slow_batches.log", "a") as f:
+            f.write(f"{dt.datetime.now().isoformat()} {report}\n")
+
 
 async def consume(
     host: str,
@@ -136,6 +383,16 @@ async def consume(
     batch_size: int = 1000,
     batch_timeout: float = 5.0,
     database_url: str | None = None,
+    profile_dir: str = "profiles",
+    profile_seconds: float | None = None,
+    slow_batch_ms: float | None = None,
+    spool_dir: str | None = None,
+    spool_latency: float = 10.0,
+    spool_errors: int = 3,
+    max_spool_bytes: int = 1024 * 1024 * 1024,
+    dead_letter_errors: int = 5,
+    max_buffer_bytes: int = 64 * 1024 * 1024,
+    cooccurrence_interval: float | None = None,
 ):
     consumer = KafkaConsumer(
         host=host,
@@ -145,6 +402,16 @@ async def consume(
         batch_size=batch_size,
         batch_timeout=batch_timeout,
         database_url=database_url,
+        profile_dir=profile_dir,
+        profile_seconds=profile_seconds,
+        slow_batch_ms=slow_batch_ms,
+        spool_dir=spool_dir,
+        spool_latency=spool_latency,
+        spool_errors=spool_errors,
+        max_spool_bytes=max_spool_bytes,
+        dead_letter_errors=dead_letter_errors,
+        max_buffer_bytes=max_buffer_bytes,
+        cooccurrence_interval=cooccurrence_interval,
     )
     try:
         await consumer.start()
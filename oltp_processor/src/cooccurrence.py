@@ -0,0 +1,209 @@
+"""Инкрементальный индекс совместной встречаемости товаров в сессиях.
+
+Для каждой сессии держим множество уже встреченных товаров (LRU по сессиям),
+новый товар сессии дает +1 каждой паре с уже встреченными. Повтор того же
+события (например, при повторной заливке батча) пару второй раз не
+увеличивает, пока сессия в LRU.
+
+В памяти копятся только приросты весов с прошлого сброса, не больше
+max_pairs пар. Сам индекс живет в product_neighbour: сброс прибавляет
+приросты к весам в БД (в обе стороны пары), поэтому несколько консьюмеров
+группы пишут каждый свою долю событий, и веса сходятся. Вес затухает
+в decay раз за час с последнего обновления пары. После сброса у затронутых
+товаров остается не больше keep самых тяжелых соседей тяжелее min_weight;
+читать соседей - top_neighbours.
+"""
+
+import heapq
+import logging
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import Float, cast, delete, func, literal, or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import data_types
+from models import ProductNeighbour
+
+logger = logging.getLogger(__name__)
+
+# Не больше ~32k параметров на запрос у asyncpg
+INSERT_CHUNK = 5000
+
+
+def decayed_weight(decay: float):
+    """Вес пары на текущий момент с учетом затухания"""
+    age = func.extract("epoch", func.now() - ProductNeighbour.updated_at)
+    hours = cast(age / 3600, Float)
+    return ProductNeighbour.weight * func.power(literal(decay, Float), hours)
+
+
+async def top_neighbours(
+    session: AsyncSession,
+    kind: str,
+    product_id: int,
+    n: int = 20,
+    decay: float = 0.95,
+) -> list[tuple[int, float]]:
+    """Top-n соседей товара по весу на текущий момент"""
+    weight = decayed_weight(decay)
+    stmt = (
+        select(ProductNeighbour.neighbour_id, weight)
+        .where(
+            ProductNeighbour.kind == kind,
+            ProductNeighbour.product_id == product_id,
+        )
+        .order_by(weight.desc(), ProductNeighbour.neighbour_id)
+        .limit(n)
+    )
+    return [tuple(row) for row in (await session.execute(stmt)).all()]
+
+
+class CooccurrenceIndex:
+    def __init__(
+        self,
+        kind: str,
+        event_types: set[str],
+        top_n: int = 20,
+        max_sessions: int = 100_000,
+        max_products_per_session: int = 50,
+        max_pairs: int = 2_000_000,
+        decay: float = 0.95,
+        min_weight: float = 0.5,
+        keep: int | None = None,
+    ):
+        self.kind = kind
+        self.event_types = event_types
+        self.top_n = top_n
+        self.max_sessions = max_sessions
+        self.max_products_per_session = max_products_per_session
+        self.max_pairs = max_pairs
+        self.decay = decay
+        self.min_weight = min_weight
+        # Запас сверх top_n: сосед может подняться в top за счет других консьюмеров
+        self.keep = keep if keep is not None else 5 * top_n
+
+        self.sessions: OrderedDict = OrderedDict()
+        # Приросты весов с прошлого сброса, пара хранится один раз как (min, max)
+        self.pending: dict[tuple[int, int], float] = defaultdict(float)
+
+    @property
+    def full(self) -> bool:
+        """Приросты пора сбросить, не дожидаясь интервала"""
+        return len(self.pending) >= self.max_pairs
+
+    def update(self, records: list[data_types.DatasetRow]):
+        for r in records:
+            if r.event_type not in self.event_types:
+                continue
+            products = self.sessions.get(r.user_session)
+            if products is None:
+                products = self.sessions[r.user_session] = set()
+                if len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            else:
+                self.sessions.move_to_end(r.user_session)
+            if (
+                r.product_id in products
+                or len(products) >= self.max_products_per_session
+            ):
+                continue
+            for other in products:
+                self.pending[min(r.product_id, other), max(r.product_id, other)] += 1
+            products.add(r.product_id)
+
+        # Если БД долго не принимает сброс, жертвуем самыми легкими парами
+        if len(self.pending) > self.max_pairs * 1.2:
+            self.prune()
+
+    def prune(self):
+        """Оставляет max_pairs самых тяжелых приростов"""
+        kept = heapq.nlargest(
+            self.max_pairs, self.pending.items(), key=lambda kv: (kv[1], kv[0])
+        )
+        logger.warning(
+            f"Dropped {len(self.pending) - len(kept)} pending {self.kind} pairs"
+        )
+        self.pending = defaultdict(float, kept)
+
+    def _restore(self, pending: dict[tuple[int, int], float]):
+        for pair, weight in pending.items():
+            self.pending[pair] += weight
+
+    async def flush(self, session: AsyncSession):
+        if not self.pending:
+            return
+        # Батчи продолжают идти, пока ждем БД: забираем текущие приросты целиком.
+        # Строки отсортированы, чтобы консьюмеры брали локи в одном порядке
+        pending, self.pending = self.pending, defaultdict(float)
+        rows = sorted(
+            (a, b, weight)
+            for (x, y), weight in pending.items()
+            for a, b in ((x, y), (y, x))
+        )
+        # Приросты возвращаются при любом сбое до коммита, включая отмену из stop()
+        committed = False
+        try:
+            for i in range(0, len(rows), INSERT_CHUNK):
+                stmt = pg_insert(ProductNeighbour).values(
+                    [
+                        {
+                            "kind": self.kind,
+                            "product_id": a,
+                            "neighbour_id": b,
+                            "weight": weight,
+                        }
+                        for a, b, weight in rows[i : i + INSERT_CHUNK]
+                    ]
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["kind", "product_id", "neighbour_id"],
+                    set_={
+                        "weight": decayed_weight(self.decay) + stmt.excluded.weight,
+                        "updated_at": func.now(),
+                    },
+                )
+                await session.execute(stmt)
+            await session.commit()
+            committed = True
+        finally:
+            if not committed:
+                self._restore(pending)
+        products = sorted({a for a, _, _ in rows})
+        logger.info(
+            f"Flushed {len(rows)} {self.kind} pair weights of {len(products)} products"
+        )
+        # Приросты уже в БД: если подрезка упадет, она повторится при следующем сбросе
+        await self.trim(session, products)
+
+    async def trim(self, session: AsyncSession, products: list[int]):
+        """Удаляет у товаров соседей за пределами keep и легче min_weight"""
+        weight = decayed_weight(self.decay)
+        for i in range(0, len(products), INSERT_CHUNK):
+            ranked = (
+                select(
+                    ProductNeighbour.product_id,
+                    ProductNeighbour.neighbour_id,
+                    weight.label("weight"),
+                    func.row_number()
+                    .over(
+                        partition_by=ProductNeighbour.product_id,
+                        order_by=(weight.desc(), ProductNeighbour.neighbour_id),
+                    )
+                    .label("rank"),
+                )
+                .where(
+                    ProductNeighbour.kind == self.kind,
+                    ProductNeighbour.product_id.in_(products[i : i + INSERT_CHUNK]),
+                )
+                .subquery()
+            )
+            await session.execute(
+                delete(ProductNeighbour).where(
+                    ProductNeighbour.kind == self.kind,
+                    ProductNeighbour.product_id == ranked.c.product_id,
+                    ProductNeighbour.neighbour_id == ranked.c.neighbour_id,
+                    or_(ranked.c.rank > self.keep, ranked.c.weight < self.min_weight),
+                )
+            )
+        await session.commit()
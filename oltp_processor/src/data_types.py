@@ -3,6 +3,9 @@ import decimal
 import uuid
 from dataclasses import dataclass
 
+# Порядок важен: индекс используется как код типа в бинарном формате
+EVENT_TYPES = ("view", "cart", "remove_from_cart", "purchase")
+
 
 @dataclass
 class DatasetRow:
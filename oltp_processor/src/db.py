@@ -1,23 +1,66 @@
 import datetime as dt
-import json
 import logging
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 from dataclasses import dataclass
 
 import prettyprinter as pp
-from sqlalchemy import func, insert, select
+from sqlalchemy import event, func, insert, select, tuple_, update
 from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session
 
 import config
 import data_types
-from models import Brand, Category, Event, Product, Purchase, User
+import profiler
+import sketches
+import wire
+from models import (
+    Brand,
+    BrandUsersSketch,
+    Category,
+    CategoryUsersSketch,
+    DailyBrandStats,
+    DailyCategoryStats,
+    Event,
+    EventType,
+    HotProductsSketch,
+    Product,
+    Purchase,
+    User,
+)
 
 logger = logging.getLogger(__name__)
 
+# asyncpg принимает не больше 32767 параметров на запрос, у события их 7
+MAX_CHUNK = 4000
+
+
+@contextmanager
+def record_statements(connection: Connection, timings: profiler.BatchTimings):
+    """Пишет размеры запросов соединения в тайминги батча"""
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        timings.add_statement(statement, parameters)
+
+    event.listen(connection, "before_cursor_execute", on_execute)
+    try:
+        yield
+    finally:
+        event.remove(connection, "before_cursor_execute", on_execute)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Сбой сети или БД, после которого ту же запись имеет смысл повторить"""
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(error, (OSError, TimeoutError, OperationalError))
+
 
 class DBProcessor:
-    def __init__(self, database_url: str | None = None):
+    def __init__(self, database_url: str | None = None, chunk_size: int = 1000):
         if not database_url:
             database_url = config.build_pg_url()
 
@@ -25,63 +68,130 @@ class DBProcessor:
         self.async_session = async_sessionmaker(
             self.engine, class_=AsyncSession, expire_on_commit=False
         )
+        # Сколько строк уходит в один запрос: батч после ретраев может быть
+        # сколь угодно большим, а число параметров запроса ограничено
+        self.chunk_size = min(chunk_size, MAX_CHUNK)
+        # Справочник маленький и почти не меняется, держим его в памяти
+        self.event_type_mapping: dict[str, int] = {}
+
+        # Тайминги последнего батча для отчета о медленных батчах
+        self.last_timings: profiler.BatchTimings | None = None
+        # Строки последнего успешно записанного батча для потоковых стадий
+        self.last_records: list[data_types.DatasetRow] = []
 
     async def close(self):
         await self.engine.dispose()
 
+    async def select_all(self, stmt) -> list:
+        """Строки запроса; у шардированного процессора - со всех шардов"""
+        async with self.async_session() as session:
+            return (await session.execute(stmt)).all()
+
     @staticmethod
-    def parse_records(records: list[str]) -> tuple[list[data_types.DatasetRow], int]:
+    def parse_records(
+        records: list[tuple[str, bytes]],
+    ) -> tuple[list[data_types.DatasetRow], int]:
         res = []
         error_count = 0
-        for value in records:
+        for fmt, value in records:
             try:
-                rec = json.loads(value)
-                ds = data_types.DatasetRow.from_dict(rec)
-                res.append(ds)
+                res.append(wire.decode(value, fmt))
             except Exception as e:
                 logger.error(f"Failed to parse record: {e}")
                 error_count += 1
         return res, error_count
 
-    async def insert_batch(self, records: list[str]):
-        try:
-            if not records:
-                return 0, 0
+    async def insert_batch(self, records: list[tuple[str, bytes]]):
+        if not records:
+            return 0, 0
+        timings = profiler.BatchTimings(len(records))
+        with timings.stage("parse", len(records)):
             parsed_records, parsing_errors_cnt = self.parse_records(records)
+        success_cnt = await self.insert_rows(parsed_records, timings)
+        return success_cnt, parsing_errors_cnt + len(parsed_records) - success_cnt
+
+    async def insert_rows(
+        self,
+        parsed_records: list[data_types.DatasetRow],
+        timings: profiler.BatchTimings,
+    ) -> int:
+        self.last_records = []
+        try:
             if not parsed_records:
-                return 0, parsing_errors_cnt
+                return 0
 
             async with self.async_session() as session:
-                await self.upsert_users(session, parsed_records)
-                await self.upsert_categories(session, parsed_records)
-                brand_mapping = await self.upsert_brands(session, parsed_records)
+                # Только запросы этого батча, без чужих сессий на том же движке
+                connection = await session.connection()
+                with record_statements(connection.sync_connection, timings):
+                    with timings.stage("users"):
+                        await self.upsert_users(session, parsed_records)
+                    with timings.stage("categories"):
+                        await self.upsert_categories(session, parsed_records)
+                    with timings.stage("brands"):
+                        brand_mapping = await self.upsert_brands(
+                            session, parsed_records
+                        )
 
-                await self.upsert_products(session, parsed_records, brand_mapping)
+                    with timings.stage("products"):
+                        await self.upsert_products(
+                            session, parsed_records, brand_mapping
+                        )
 
-                events, purchases = self.prepare_events_and_purchases(parsed_records)
-                await self.insert_events(session, events)
-                await self.insert_purchases(session, purchases)
+                    with timings.stage("event_types"):
+                        event_type_mapping = await self.upsert_event_types(
+                            session, parsed_records
+                        )
+                    events, purchases = self.prepare_events_and_purchases(
+                        parsed_records, event_type_mapping
+                    )
+                    with timings.stage("events", len(events)):
+                        inserted_ids = await self.insert_events(session, events)
+                    with timings.stage("purchases", len(purchases)):
+                        inserted_ids |= await self.insert_purchases(session, purchases)
 
-                await session.commit()
+                    # Повторно пришедшие строки в агрегаты не попадают
+                    new_records = self.filter_inserted(parsed_records, inserted_ids)
+                    category_deltas, brand_deltas = self.prepare_rollups(
+                        new_records, event_type_mapping, brand_mapping
+                    )
+                    with timings.stage("rollups"):
+                        await self.upsert_rollups(
+                            session, category_deltas, brand_deltas
+                        )
+                    with timings.stage("sketches", len(new_records)):
+                        await self.update_sketches(session, new_records, brand_mapping)
+
+                    with timings.stage("commit"):
+                        await session.commit()
+                self.event_type_mapping = event_type_mapping
+                self.last_records = parsed_records
                 success_cnt = len(parsed_records)
                 logger.info(f"Successfully inserted {success_cnt} records")
-                return success_cnt, parsing_errors_cnt
+                return success_cnt
         except Exception as e:
+            # Пробрасываем, чтобы консьюмер не закоммитил оффсеты незаписанного батча
             logger.error(f"Error during batch insert: {e}", exc_info=True)
-            return 0, parsing_errors_cnt + len(parsed_records)
+            raise
+        finally:
+            self.last_timings = timings
 
     async def upsert_users(
         self, session: AsyncSession, records: list[data_types.DatasetRow]
     ):
-        user_ids = {r.user_id for r in records}
-        if not user_ids:
-            return
-        stmt = (
-            pg_insert(User)
-            .values([{"user_id": user_id} for user_id in user_ids])
-            .on_conflict_do_nothing(index_elements=["user_id"])
-        )
-        await session.execute(stmt)
+        user_ids = sorted({r.user_id for r in records})
+        for i in range(0, len(user_ids), self.chunk_size):
+            stmt = (
+                pg_insert(User)
+                .values(
+                    [
+                        {"user_id": user_id}
+                        for user_id in user_ids[i : i + self.chunk_size]
+                    ]
+                )
+                .on_conflict_do_nothing(index_elements=["user_id"])
+            )
+            await session.execute(stmt)
         logger.debug(f"Upserted {len(user_ids)} users")
 
     async def upsert_categories(
@@ -91,48 +201,69 @@ class DBProcessor:
             r.category_id: r.category_code if r.category_code != "" else None
             for r in records
         }
-        if not categories:
-            return
-        stmt = pg_insert(Category).values(
-            [
-                {"category_id": cid, "category_code": code}
-                for cid, code in categories.items()
-            ]
-        )
-        stmt = stmt.on_conflict_do_update(
-            index_elements=["category_id"],
-            set_={
-                "category_code": func.coalesce(
-                    stmt.excluded.category_code,
-                    Category.category_code,
-                )
-            },
-        )
-
-        await session.execute(stmt)
+        values = [
+            {"category_id": cid, "category_code": code}
+            for cid, code in sorted(categories.items())
+        ]
+        for i in range(0, len(values), self.chunk_size):
+            stmt = pg_insert(Category).values(values[i : i + self.chunk_size])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["category_id"],
+                set_={
+                    "category_code": func.coalesce(
+                        stmt.excluded.category_code,
+                        Category.category_code,
+                    )
+                },
+            )
+            await session.execute(stmt)
         logger.debug(f"Upserted {len(categories)} categories")
 
     async def upsert_brands(
         self, session: AsyncSession, records: list[data_types.DatasetRow]
     ) -> dict[str, int]:
-        brands = {r.brand for r in records if r.brand}
-        if not brands:
-            return {}
+        brands = sorted({r.brand for r in records if r.brand})
+        brand_mapping = {}
+        for i in range(0, len(brands), self.chunk_size):
+            chunk = brands[i : i + self.chunk_size]
+            stmt = (
+                pg_insert(Brand)
+                .values([{"brand_name": name} for name in chunk])
+                .on_conflict_do_nothing(index_elements=["brand_name"])
+            )
+            await session.execute(stmt)
+            stmt = select(Brand.brand_name, Brand.brand_id).where(
+                Brand.brand_name.in_(chunk)
+            )
+            result = await session.execute(stmt)
+            brand_mapping.update(result.all())
+
+        logger.debug(f"Loaded {len(brand_mapping)} brand mappings")
+        return brand_mapping
+
+    async def upsert_event_types(
+        self, session: AsyncSession, records: list[data_types.DatasetRow]
+    ) -> dict[str, int]:
+        event_types = {r.event_type for r in records}
+        unknown = event_types - self.event_type_mapping.keys()
+        if not unknown:
+            return self.event_type_mapping
 
         stmt = (
-            pg_insert(Brand)
-            .values([{"brand_name": name} for name in brands])
-            .on_conflict_do_nothing(index_elements=["brand_name"])
+            pg_insert(EventType)
+            .values([{"event_type_name": name} for name in unknown])
+            .on_conflict_do_nothing(index_elements=["event_type_name"])
         )
         await session.execute(stmt)
-        stmt = select(Brand.brand_name, Brand.brand_id).where(
-            Brand.brand_name.in_(brands)
+        stmt = select(EventType.event_type_name, EventType.event_type_id).where(
+            EventType.event_type_name.in_(unknown)
         )
         result = await session.execute(stmt)
-        brand_mapping = dict(result.all())
+        # В кэш попадут только после коммита батча
+        mapping = {**self.event_type_mapping, **dict(result.all())}
 
-        logger.debug(f"Loaded {len(brand_mapping)} brand mappings")
-        return brand_mapping
+        logger.debug(f"Loaded {len(unknown)} event type mappings")
+        return mapping
 
     async def upsert_products(
         self,
@@ -148,28 +279,29 @@ class DBProcessor:
                 "category_id": r.category_id,
                 "brand_id": brand_id,
             }
-        if not products:
-            return
-
-        stmt = pg_insert(Product).values(list(products.values()))
-        stmt = stmt.on_conflict_do_update(
-            index_elements=["product_id"],
-            set_={
-                "category_id": func.coalesce(
-                    stmt.excluded.category_id,
-                    Product.category_id,
-                ),
-                "brand_id": func.coalesce(
-                    stmt.excluded.brand_id,
-                    Product.brand_id,
-                ),
-            },
-        )
-        await session.execute(stmt)
+        values = [products[product_id] for product_id in sorted(products)]
+        for i in range(0, len(values), self.chunk_size):
+            stmt = pg_insert(Product).values(values[i : i + self.chunk_size])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["product_id"],
+                set_={
+                    "category_id": func.coalesce(
+                        stmt.excluded.category_id,
+                        Product.category_id,
+                    ),
+                    "brand_id": func.coalesce(
+                        stmt.excluded.brand_id,
+                        Product.brand_id,
+                    ),
+                },
+            )
+            await session.execute(stmt)
         logger.debug(f"Upserted {len(products)} products")
 
     def prepare_events_and_purchases(
-        self, records: list[data_types.DatasetRow]
+        self,
+        records: list[data_types.DatasetRow],
+        event_type_mapping: dict[str, int],
     ) -> tuple[list[dict], list[dict]]:
         events = []
         purchases = []
@@ -187,27 +319,192 @@ class DBProcessor:
             if r.event_type == "purchase":
                 purchases.append(data)
             else:
-                events.append({**data, "event_type": r.event_type})
+                events.append(
+                    {**data, "event_type_id": event_type_mapping[r.event_type]}
+                )
         return events, purchases
 
-    async def insert_events(self, session: AsyncSession, events: list[dict]):
-        if not events:
-            return
-        stmt = (
-            pg_insert(Event)
-            .values(events)
-            .on_conflict_do_nothing(index_elements=["id"])
+    async def insert_events(self, session: AsyncSession, events: list[dict]) -> set:
+        inserted = set()
+        for i in range(0, len(events), self.chunk_size):
+            stmt = (
+                pg_insert(Event)
+                .values(events[i : i + self.chunk_size])
+                .on_conflict_do_nothing(index_elements=["id"])
+                .returning(Event.id)
+            )
+            result = await session.execute(stmt)
+            inserted.update(result.scalars().all())
+        logger.debug(f"Inserted {len(inserted)} of {len(events)} events")
+        return inserted
+
+    async def insert_purchases(
+        self, session: AsyncSession, purchases: list[dict]
+    ) -> set:
+        inserted = set()
+        for i in range(0, len(purchases), self.chunk_size):
+            stmt = (
+                pg_insert(Purchase)
+                .values(purchases[i : i + self.chunk_size])
+                .on_conflict_do_nothing(index_elements=["id"])
+                .returning(Purchase.id)
+            )
+            result = await session.execute(stmt)
+            inserted.update(result.scalars().all())
+        logger.debug(f"Inserted {len(inserted)} of {len(purchases)} purchases")
+        return inserted
+
+    @staticmethod
+    def filter_inserted(
+        records: list[data_types.DatasetRow], inserted_ids: set
+    ) -> list[data_types.DatasetRow]:
+        """Только реально вставленные строки, без дублей внутри батча"""
+        res = {}
+        for r in records:
+            if r.row_id in inserted_ids and r.row_id not in res:
+                res[r.row_id] = r
+        return list(res.values())
+
+    def prepare_rollups(
+        self,
+        records: list[data_types.DatasetRow],
+        event_type_mapping: dict[str, int],
+        brand_mapping: dict[str, int],
+    ) -> tuple[Counter, Counter]:
+        category_deltas = Counter()
+        brand_deltas = Counter()
+        for r in records:
+            day = r.event_time.astimezone(dt.timezone.utc).date()
+            event_type_id = event_type_mapping[r.event_type]
+            category_deltas[(day, event_type_id, r.category_id)] += 1
+            if r.brand:
+                brand_deltas[(day, event_type_id, brand_mapping[r.brand])] += 1
+        return category_deltas, brand_deltas
+
+    async def upsert_rollups(
+        self,
+        session: AsyncSession,
+        category_deltas: Counter,
+        brand_deltas: Counter,
+    ):
+        # Сортируем ключи, чтобы параллельные консьюмеры брали локи в одном порядке
+        for model, key_column, deltas in (
+            (DailyCategoryStats, "category_id", category_deltas),
+            (DailyBrandStats, "brand_id", brand_deltas),
+        ):
+            values = [
+                {
+                    "day": day,
+                    "event_type_id": event_type_id,
+                    key_column: key,
+                    "cnt": cnt,
+                }
+                for (day, event_type_id, key), cnt in sorted(deltas.items())
+            ]
+            for i in range(0, len(values), self.chunk_size):
+                stmt = pg_insert(model).values(values[i : i + self.chunk_size])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["day", "event_type_id", key_column],
+                    set_={"cnt": model.cnt + stmt.excluded.cnt},
+                )
+                await session.execute(stmt)
+            logger.debug(f"Upserted {len(deltas)} {model.__tablename__} rows")
+
+    def prepare_sketches(
+        self, records: list[data_types.DatasetRow], brand_mapping: dict[str, int]
+    ) -> tuple[dict, dict, dict]:
+        category_users = defaultdict(sketches.HyperLogLog)
+        brand_users = defaultdict(sketches.HyperLogLog)
+        hot_products = defaultdict(sketches.TopK)
+        for r in records:
+            event_time = r.event_time.astimezone(dt.timezone.utc)
+            day = event_time.date()
+            hour = event_time.replace(minute=0, second=0, microsecond=0)
+            category_users[(day, r.category_id)].add(r.user_id)
+            if r.brand:
+                brand_users[(day, brand_mapping[r.brand])].add(r.user_id)
+            hot_products[(hour,)].add(r.product_id)
+        return category_users, brand_users, hot_products
+
+    async def update_sketches(
+        self,
+        session: AsyncSession,
+        records: list[data_types.DatasetRow],
+        brand_mapping: dict[str, int],
+    ):
+        category_users, brand_users, hot_products = self.prepare_sketches(
+            records, brand_mapping
+        )
+        await self.merge_sketches(
+            session,
+            CategoryUsersSketch,
+            ("day", "category_id"),
+            category_users,
+            sketches.HyperLogLog.from_bytes,
+        )
+        await self.merge_sketches(
+            session,
+            BrandUsersSketch,
+            ("day", "brand_id"),
+            brand_users,
+            sketches.HyperLogLog.from_bytes,
+        )
+        await self.merge_sketches(
+            session,
+            HotProductsSketch,
+            ("hour",),
+            hot_products,
+            sketches.TopK.from_bytes,
         )
-        await session.execute(stmt)
-        logger.debug(f"Inserted {len(events)} events")
 
-    async def insert_purchases(self, session: AsyncSession, purchases: list[dict]):
-        if not purchases:
+    async def merge_sketches(
+        self,
+        session: AsyncSession,
+        model,
+        key_columns: tuple[str, ...],
+        batch_sketches: dict[tuple, object],
+        load,
+    ):
+        if not batch_sketches:
             return
-        stmt = (
-            pg_insert(Purchase)
-            .values(purchases)
-            .on_conflict_do_nothing(index_elements=["id"])
+        columns = [getattr(model, c) for c in key_columns]
+        keys = sorted(batch_sketches)
+
+        # Новые бакеты просто вставляем, существующие сливаем под локом строки
+        inserted = set()
+        for i in range(0, len(keys), self.chunk_size):
+            stmt = (
+                pg_insert(model)
+                .values(
+                    [
+                        {
+                            **dict(zip(key_columns, key)),
+                            "sketch": batch_sketches[key].to_bytes(),
+                        }
+                        for key in keys[i : i + self.chunk_size]
+                    ]
+                )
+                .on_conflict_do_nothing()
+                .returning(*columns)
+            )
+            inserted.update(tuple(row) for row in (await session.execute(stmt)).all())
+        existing = [key for key in keys if key not in inserted]
+
+        for i in range(0, len(existing), self.chunk_size):
+            stmt = (
+                select(*columns, model.sketch)
+                .where(tuple_(*columns).in_(existing[i : i + self.chunk_size]))
+                .order_by(*columns)
+                .with_for_update()
+            )
+            updates = []
+            for *key, data in (await session.execute(stmt)).all():
+                merged = load(data).merge(batch_sketches[tuple(key)])
+                updates.append(
+                    {**dict(zip(key_columns, key)), "sketch": merged.to_bytes()}
+                )
+            if updates:
+                await session.execute(update(model), updates)
+        logger.debug(
+            f"Merged {len(keys)} {model.__tablename__} sketches, {len(inserted)} new"
         )
-        await session.execute(stmt)
-        logger.debug(f"Inserted {len(purchases)} purchases")
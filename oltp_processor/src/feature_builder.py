@@ -0,0 +1,165 @@
+"""Офлайн-сборка обучающей выборки с фичами на момент каждой метки.
+
+Метки - csv с колонками user_id и timestamp. События - подневные паркеты
+``data_<date>_<chunk>.parquet`` (см. dataset_processing/split_dataset.ipynb).
+
+Метки должны быть отсортированы по timestamp: файл читается потоком, и
+метки одного дня отдаются в работу, как только начался следующий день.
+Каждый день считается отдельным процессом: читаем партиции за
+[день - MAX_WINDOW, день] только для пользователей с метками в этот день,
+по порядку дней, и идем по событиям и меткам одним отсортированным проходом
+(as-of merge). В работе одновременно не больше 2 * workers дней, в каждом
+процессе держится не больше одной партиции и окна событий нужных
+пользователей.
+"""
+
+import csv
+import datetime as dt
+import decimal
+import logging
+import os
+from collections import defaultdict, deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import features
+
+logger = logging.getLogger(__name__)
+
+EVENT_COLUMNS = ["event_time", "event_type", "price", "user_id"]
+
+
+def list_partitions(data_dir: str | Path) -> dict[dt.date, list[Path]]:
+    partitions = defaultdict(list)
+    for path in sorted(Path(data_dir).glob("*.parquet")):
+        # формат названия: data_<date>_<chunk_no>.parquet
+        try:
+            day = dt.date.fromisoformat(path.stem.split("_")[1])
+        except (IndexError, ValueError):
+            logger.warning(f"Cannot parse date from filename: {path.name}")
+            continue
+        partitions[day].append(path)
+    return partitions
+
+
+def _as_utc(value: dt.datetime) -> dt.datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=dt.timezone.utc)
+    return value.astimezone(dt.timezone.utc)
+
+
+def read_labels(
+    labels_path: str | Path,
+) -> Iterator[tuple[dt.date, list[tuple[int, dt.datetime]]]]:
+    """Метки по дням, в порядке файла; день не должен встречаться дважды"""
+    seen = set()
+    day, labels = None, []
+    with open(labels_path, newline="") as f:
+        for row in csv.DictReader(f):
+            ts = _as_utc(dt.datetime.fromisoformat(row["timestamp"]))
+            if ts.date() != day:
+                if labels:
+                    yield day, labels
+                day, labels = ts.date(), []
+                if day in seen:
+                    raise ValueError(
+                        f"{labels_path}: labels must be sorted by timestamp, "
+                        f"{day} occurs again"
+                    )
+                seen.add(day)
+            labels.append((int(row["user_id"]), ts))
+    if labels:
+        yield day, labels
+
+
+def read_partition(paths: list[Path], users: set[int]) -> list[tuple]:
+    """События дня для заданных пользователей, отсортированные по времени"""
+    import pyarrow.parquet as pq
+
+    events = []
+    for path in paths:
+        table = pq.read_table(
+            path, columns=EVENT_COLUMNS, filters=[("user_id", "in", list(users))]
+        )
+        for r in table.to_pylist():
+            events.append(
+                (
+                    _as_utc(r["event_time"]),
+                    r["user_id"],
+                    r["event_type"],
+                    decimal.Decimal(str(r["price"])),
+                )
+            )
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+def build_day(
+    day: dt.date,
+    labels: list[tuple[int, dt.datetime]],
+    partitions: dict[dt.date, list[Path]],
+) -> list[dict]:
+    labels = sorted(labels, key=lambda label: label[1])
+    users = {user_id for user_id, _ in labels}
+    states = defaultdict(features.UserFeatureState)
+    res = []
+    pos = 0
+
+    first_day = (labels[0][1] - features.MAX_WINDOW).date()
+    for offset in range((day - first_day).days + 1):
+        events = read_partition(
+            partitions.get(first_day + dt.timedelta(days=offset), []), users
+        )
+        for event_time, user_id, event_type, price in events:
+            # метка видит события с event_time <= ts
+            while pos < len(labels) and labels[pos][1] < event_time:
+                user_id_, ts = labels[pos]
+                res.append(
+                    {"user_id": user_id_, "timestamp": ts}
+                    | states[user_id_].features(ts)
+                )
+                pos += 1
+            states[user_id].add(event_time, event_type, price)
+
+    for user_id, ts in labels[pos:]:
+        res.append({"user_id": user_id, "timestamp": ts} | states[user_id].features(ts))
+    return res
+
+
+def build(
+    labels_path: str | Path,
+    data_dir: str | Path,
+    output_path: str | Path,
+    workers: int | None = None,
+) -> int:
+    partitions = list_partitions(data_dir)
+    workers = workers or os.cpu_count() or 1
+
+    written = 0
+    with (
+        ProcessPoolExecutor(max_workers=workers) as pool,
+        open(output_path, "w", newline="") as f,
+    ):
+        writer = csv.DictWriter(
+            f, fieldnames=["user_id", "timestamp", *features.feature_names()]
+        )
+        writer.writeheader()
+
+        def write_oldest():
+            nonlocal written
+            day, future = running.popleft()
+            rows = future.result()
+            writer.writerows(rows)
+            written += len(rows)
+            logger.info(f"{day}: {len(rows)} labels")
+
+        # Результаты пишутся в порядке дней, новые дни отправляются по мере записи
+        running = deque()
+        for day, labels in read_labels(labels_path):
+            if len(running) >= 2 * workers:
+                write_oldest()
+            running.append((day, pool.submit(build_day, day, labels, partitions)))
+        while running:
+            write_oldest()
+    return written
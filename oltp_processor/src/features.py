@@ -0,0 +1,67 @@
+"""Определения оконных фичей пользователя.
+
+Это единственное место, где задаются фичи: офлайн-сборка обучающей выборки
+(feature_builder.py) считает их через UserFeatureState. Онлайн-расчета пока
+нет; когда появится, он должен использовать тот же UserFeatureState.
+
+Событие попадает в окно ``w`` для момента ``ts``, если
+``ts - w < event_time <= ts``. Покупки считаются отдельным типом события
+``purchase``, ``spend`` - сумма цен покупок.
+"""
+
+import datetime as dt
+import decimal
+from collections import deque
+
+import data_types
+
+WINDOWS = {
+    "1h": dt.timedelta(hours=1),
+    "24h": dt.timedelta(hours=24),
+    "7d": dt.timedelta(days=7),
+}
+MAX_WINDOW = max(WINDOWS.values())
+
+
+def feature_names() -> list[str]:
+    names = []
+    for window in WINDOWS:
+        names.extend(
+            f"{event_type}_cnt_{window}" for event_type in data_types.EVENT_TYPES
+        )
+        names.append(f"spend_{window}")
+    return names
+
+
+class UserFeatureState:
+    """События одного пользователя за последние MAX_WINDOW.
+
+    События нужно добавлять в порядке event_time, а features вызывать
+    с неубывающими ts не раньше последнего добавленного события.
+    """
+
+    def __init__(self):
+        self.events: deque[tuple[dt.datetime, str, decimal.Decimal]] = deque()
+
+    def add(self, event_time: dt.datetime, event_type: str, price: decimal.Decimal):
+        self.events.append((event_time, event_type, price))
+
+    def features(self, ts: dt.datetime) -> dict:
+        while self.events and self.events[0][0] <= ts - MAX_WINDOW:
+            self.events.popleft()
+
+        res = {}
+        for window, size in WINDOWS.items():
+            start = ts - size
+            counts = dict.fromkeys(data_types.EVENT_TYPES, 0)
+            spend = decimal.Decimal(0)
+            for event_time, event_type, price in self.events:
+                if event_time <= start or event_time > ts:
+                    continue
+                counts[event_type] = counts.get(event_type, 0) + 1
+                if event_type == "purchase":
+                    spend += price
+            for event_type in data_types.EVENT_TYPES:
+                res[f"{event_type}_cnt_{window}"] = counts[event_type]
+            res[f"spend_{window}"] = spend
+        return res
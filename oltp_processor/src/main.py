@@ -5,6 +5,9 @@ import sys
 import click
 
 import consumer
+import feature_builder
+import sharding
+import timeline
 from config import load_config
 
 
@@ -86,8 +89,74 @@ def cli(
 
 
 @cli.command()
+@click.option(
+    "--profile-seconds",
+    type=float,
+    default=None,
+    help="Profile the first N seconds (SIGUSR1 profiles for N seconds at any time)",
+)
+@click.option("--profile-dir", default="profiles", help="Profiler output folder")
+@click.option(
+    "--slow-batch-ms",
+    type=float,
+    default=None,
+    help="Report stage timings of batches slower than this",
+)
+@click.option(
+    "--spool-dir",
+    default=None,
+    help="Spool batches to this folder while Postgres is slow or failing",
+)
+@click.option(
+    "--spool-latency",
+    type=float,
+    default=10.0,
+    help="Spool a batch if its DB write takes longer, seconds",
+)
+@click.option(
+    "--spool-errors",
+    type=int,
+    default=3,
+    help="Spool after this many DB write errors in a row",
+)
+@click.option(
+    "--max-spool-mb",
+    type=int,
+    default=1024,
+    help="Stop spooling and wait for the drainer when the spool is this big",
+)
+@click.option(
+    "--dead-letter-errors",
+    type=int,
+    default=5,
+    help="Move a spooled batch to spool-dir/dead after this many DB rejections",
+)
+@click.option(
+    "--max-buffer-mb",
+    type=int,
+    default=64,
+    help="Pause fetching when buffered messages take more memory",
+)
+@click.option(
+    "--cooccurrence-interval",
+    type=float,
+    default=None,
+    help="Maintain product co-occurrence and flush it every N seconds",
+)
 @click.pass_context
-def consume(ctx):
+def consume(
+    ctx,
+    profile_seconds: float,
+    profile_dir: str,
+    slow_batch_ms: float,
+    spool_dir: str,
+    spool_latency: float,
+    spool_errors: int,
+    max_spool_mb: int,
+    dead_letter_errors: int,
+    max_buffer_mb: int,
+    cooccurrence_interval: float,
+):
     """Start consuming from kafka"""
     kafka_host = ctx.obj["kafka_host"]
     kafka_port = ctx.obj["kafka_port"]
@@ -103,7 +172,65 @@ def consume(ctx):
 
     click.echo(f"consuming from server on {kafka_host}:{kafka_port}@{kafka_topic}")
     click.echo(f"pg on {pg_user}:{pg_password}@{pg_host}:{pg_port} ")
-    asyncio.run(consumer.consume(kafka_host, kafka_port, kafka_topic, verbose))
+    asyncio.run(
+        consumer.consume(
+            kafka_host,
+            kafka_port,
+            kafka_topic,
+            verbose,
+            profile_dir=profile_dir,
+            profile_seconds=profile_seconds,
+            slow_batch_ms=slow_batch_ms,
+            spool_dir=spool_dir,
+            spool_latency=spool_latency,
+            spool_errors=spool_errors,
+            max_spool_bytes=max_spool_mb * 1024 * 1024,
+            dead_letter_errors=dead_letter_errors,
+            max_buffer_bytes=max_buffer_mb * 1024 * 1024,
+            cooccurrence_interval=cooccurrence_interval,
+        )
+    )
+
+
+@cli.command()
+@click.option(
+    "--labels",
+    required=True,
+    help="CSV with user_id,timestamp labels sorted by timestamp",
+)
+@click.option("--data-dir", required=True, help="Folder with daily parquet files")
+@click.option("--output", required=True, help="Output CSV path")
+@click.option("--workers", type=int, default=None, help="Number of processes")
+@click.pass_context
+def build_features(ctx, labels: str, data_dir: str, output: str, workers: int):
+    """Build point-in-time user features for labels"""
+    setup_logging(ctx.obj["verbose"])
+    written = feature_builder.build(labels, data_dir, output, workers)
+    click.echo(f"{written} rows written to {output}")
+
+
+@cli.command("timeline")
+@click.option("--user-id", type=int, required=True, help="User id")
+@click.option("--limit", type=int, default=20, help="Number of events")
+@click.pass_context
+def show_timeline(ctx, user_id: int, limit: int):
+    """Print the latest events of a user"""
+
+    async def run():
+        processor = sharding.create_processor()
+        try:
+            page = await timeline.TimelineService(processor).get_timeline(
+                user_id, limit
+            )
+        finally:
+            await processor.close()
+        for e in page.entries:
+            click.echo(
+                f"{e.event_time.isoformat()} {e.event_type:<16} "
+                f"product={e.product_id} price={e.price}"
+            )
+
+    asyncio.run(run())
 
 
 @cli.command()
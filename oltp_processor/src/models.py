@@ -1,14 +1,18 @@
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 from uuid import UUID
 
 from sqlalchemy import (
     BigInteger,
+    Date,
     DateTime,
+    Float,
     ForeignKey,
     Index,
     Integer,
+    LargeBinary,
     Numeric,
+    SmallInteger,
     String,
     UniqueConstraint,
     func,
@@ -74,35 +78,154 @@ class Product(Base):
     )
 
 
+class EventType(Base):
+    __tablename__ = "event_type"
+
+    event_type_id: Mapped[int] = mapped_column(
+        SmallInteger, primary_key=True, autoincrement=True
+    )
+    event_type_name: Mapped[str] = mapped_column(
+        String(50), unique=True, nullable=False
+    )
+
+
+# Порядок колонок в event подобран под выравнивание: сначала 8-байтовые,
+# потом uuid, smallint и numeric переменной длины в конце.
+# id объявляется в каждой таблице, чтобы задать свою позицию
 class BaseEventMixin:
     event_time: Mapped[datetime] = mapped_column(
-        DateTime(timezone=True), nullable=False
+        DateTime(timezone=True), nullable=False, sort_order=-10
     )
     product_id: Mapped[int] = mapped_column(
-        BigInteger, ForeignKey("product.product_id"), nullable=False
+        BigInteger, ForeignKey("product.product_id"), nullable=False, sort_order=-9
     )
     user_id: Mapped[int] = mapped_column(
-        BigInteger, ForeignKey("user.user_id"), nullable=False
+        BigInteger, ForeignKey("user.user_id"), nullable=False, sort_order=-8
     )
-    user_session: Mapped[UUID] = mapped_column(PG_UUID(as_uuid=True), nullable=False)
-    price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)
-    created_at: Mapped[datetime] = mapped_column(
-        DateTime(timezone=True), server_default=func.now()
+    user_session: Mapped[UUID] = mapped_column(
+        PG_UUID(as_uuid=True), nullable=False, sort_order=-6
+    )
+    price: Mapped[Decimal] = mapped_column(
+        Numeric(10, 2), nullable=False, sort_order=10
     )
 
 
 class Purchase(Base, BaseEventMixin):
     __tablename__ = "purchase"
+    __table_args__ = (
+        Index("ix_purchase_event_time_brin", "event_time", postgresql_using="brin"),
+        # Покрывающий индекс под ленту пользователя (timeline.py)
+        Index(
+            "ix_purchase_user_timeline",
+            "user_id",
+            "event_time",
+            "id",
+            postgresql_include=["product_id", "price", "user_session"],
+        ),
+    )
 
-    id: Mapped[UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+    # purchase не пересоздавалась: id первым, как в исходной миграции,
+    # 16 байт uuid выравнивание 8-байтовых колонок не ломают
+    id: Mapped[UUID] = mapped_column(
+        PG_UUID(as_uuid=True), primary_key=True, sort_order=-11
+    )
     # Все остальные поля наследуются из BaseEventMixin
 
 
 class Event(Base, BaseEventMixin):
     __tablename__ = "event"
+    __table_args__ = (
+        Index("ix_event_event_time_brin", "event_time", postgresql_using="brin"),
+        Index(
+            "ix_event_user_timeline",
+            "user_id",
+            "event_time",
+            "id",
+            postgresql_include=[
+                "event_type_id",
+                "product_id",
+                "price",
+                "user_session",
+            ],
+        ),
+    )
 
-    id: Mapped[UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
-    event_type: Mapped[str] = mapped_column(
-        String(50), nullable=False
+    id: Mapped[UUID] = mapped_column(
+        PG_UUID(as_uuid=True), primary_key=True, sort_order=-7
+    )
+    event_type_id: Mapped[int] = mapped_column(
+        SmallInteger, ForeignKey("event_type.event_type_id"), nullable=False
     )  # view, cart, etc
     # Все остальные поля наследуются из BaseEventMixin
+
+
+# Дневные агрегаты, пополняются из каждого батча вместе с фактами
+class DailyCategoryStats(Base):
+    __tablename__ = "daily_category_stats"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    event_type_id: Mapped[int] = mapped_column(
+        SmallInteger, ForeignKey("event_type.event_type_id"), primary_key=True
+    )
+    category_id: Mapped[str] = mapped_column(
+        String(256), ForeignKey("category.category_id"), primary_key=True
+    )
+    cnt: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+
+class DailyBrandStats(Base):
+    __tablename__ = "daily_brand_stats"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    event_type_id: Mapped[int] = mapped_column(
+        SmallInteger, ForeignKey("event_type.event_type_id"), primary_key=True
+    )
+    brand_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("brand.brand_id"), primary_key=True
+    )
+    cnt: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+
+# Сериализованные скетчи (см. sketches.py), сливаются при каждом батче
+class CategoryUsersSketch(Base):
+    __tablename__ = "category_users_sketch"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    category_id: Mapped[str] = mapped_column(
+        String(256), ForeignKey("category.category_id"), primary_key=True
+    )
+    sketch: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+class BrandUsersSketch(Base):
+    __tablename__ = "brand_users_sketch"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    brand_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("brand.brand_id"), primary_key=True
+    )
+    sketch: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+class HotProductsSketch(Base):
+    __tablename__ = "hot_products_sketch"
+
+    hour: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+    sketch: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+class ProductNeighbour(Base):
+    """Веса товаров, которые смотрят/покупают в одной сессии с product_id.
+
+    weight затухает со временем от updated_at, см. cooccurrence.top_neighbours
+    """
+
+    __tablename__ = "product_neighbour"
+
+    kind: Mapped[str] = mapped_column(String(16), primary_key=True)  # viewed, bought
+    product_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    neighbour_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    weight: Mapped[float] = mapped_column(Float, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
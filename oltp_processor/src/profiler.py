@@ -0,0 +1,125 @@
+"""Встроенный сэмплирующий профайлер и отчет по медленным батчам.
+
+Профайлер - отдельный поток, который раз в ``interval`` секунд снимает стек
+главного потока через ``sys._current_frames`` и считает одинаковые стеки.
+Результат пишется в collapsed-формате (``a;b;c 42``), который понимают
+flamegraph.pl и speedscope.
+"""
+
+import collections
+import datetime as dt
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    def __init__(self, output_dir: str | Path, interval: float = 0.005):
+        self.output_dir = Path(output_dir)
+        self.interval = interval
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float) -> bool:
+        """Запускает профилирование текущего потока на ``seconds`` секунд"""
+        if self.running:
+            logger.warning("Profiler is already running")
+            return False
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(threading.get_ident(), seconds),
+            name="sampling-profiler",
+            daemon=True,
+        )
+        self._thread.start()
+        logger.info(f"Profiling for {seconds}s, output in {self.output_dir}")
+        return True
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_qualname} ({Path(code.co_filename).name})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _run(self, thread_id: int, seconds: float):
+        samples = collections.Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            samples[self._collapse(frame)] += 1
+            del frame
+            time.sleep(self.interval)
+
+        stamp = dt.datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = self.output_dir / f"profile-{stamp}.collapsed"
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"Profile with {samples.total()} samples written to {path}")
+
+
+@dataclass
+class Stage:
+    name: str
+    seconds: float = 0.0
+    rows: int | None = None
+    started: float = 0.0
+    statements: list[tuple[int, int]] = field(default_factory=list)
+
+
+class BatchTimings:
+    """Тайминги стадий обработки одного батча"""
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.stages: list[Stage] = []
+
+    @contextmanager
+    def stage(self, name: str, rows: int | None = None):
+        current = Stage(name, rows=rows, started=time.perf_counter())
+        self.stages.append(current)
+        try:
+            yield current
+        finally:
+            current.seconds = time.perf_counter() - current.started
+
+    def add_statement(self, statement: str, parameters):
+        """Размер SQL и число параметров, вызывается из before_cursor_execute"""
+        if not self.stages:
+            return
+        params = len(parameters) if parameters is not None else 0
+        self.stages[-1].statements.append((len(statement), params))
+
+    @property
+    def total(self) -> float:
+        """Время от начала первой стадии до конца последней"""
+        if not self.stages:
+            return 0.0
+        end = max(s.started + s.seconds for s in self.stages)
+        return end - min(s.started for s in self.stages)
+
+    def report(self) -> str:
+        lines = [f"Slow batch: {self.batch_size} messages in {self.total * 1e3:.1f} ms"]
+        for s in self.stages:
+            line = f"  {s.name:<12} {s.seconds * 1e3:9.1f} ms"
+            if s.rows is not None:
+                line += f"  rows={s.rows}"
+            for sql_len, params in s.statements:
+                line += f"  sql={sql_len}B params={params}"
+            lines.append(line)
+        return "\n".join(lines)
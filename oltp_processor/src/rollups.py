@@ -0,0 +1,59 @@
+"""Чтение дневных агрегатов daily_category_stats и daily_brand_stats.
+
+Хелперы принимают DBProcessor или ShardedDBProcessor. event_type_id и
+brand_id в каждом шарде свои, поэтому счетчики шардов складываются по
+event_type_name и brand_name.
+"""
+
+import datetime as dt
+from collections import Counter
+
+from sqlalchemy import select
+
+from models import Brand, DailyBrandStats, DailyCategoryStats, EventType
+
+
+async def _sum(db_processor, stmt) -> Counter:
+    res = Counter()
+    for *key, cnt in await db_processor.select_all(stmt):
+        res[tuple(key)] += cnt
+    return res
+
+
+async def category_daily_counts(
+    db_processor, start: dt.date, end: dt.date, category_id: str | None = None
+) -> Counter:
+    """Число событий по (day, event_type_name, category_id) за дни [start, end]"""
+    stmt = (
+        select(
+            DailyCategoryStats.day,
+            EventType.event_type_name,
+            DailyCategoryStats.category_id,
+            DailyCategoryStats.cnt,
+        )
+        .join(EventType, EventType.event_type_id == DailyCategoryStats.event_type_id)
+        .where(DailyCategoryStats.day >= start, DailyCategoryStats.day <= end)
+    )
+    if category_id is not None:
+        stmt = stmt.where(DailyCategoryStats.category_id == category_id)
+    return await _sum(db_processor, stmt)
+
+
+async def brand_daily_counts(
+    db_processor, start: dt.date, end: dt.date, brand_name: str | None = None
+) -> Counter:
+    """Число событий по (day, event_type_name, brand_name) за дни [start, end]"""
+    stmt = (
+        select(
+            DailyBrandStats.day,
+            EventType.event_type_name,
+            Brand.brand_name,
+            DailyBrandStats.cnt,
+        )
+        .join(EventType, EventType.event_type_id == DailyBrandStats.event_type_id)
+        .join(Brand, Brand.brand_id == DailyBrandStats.brand_id)
+        .where(DailyBrandStats.day >= start, DailyBrandStats.day <= end)
+    )
+    if brand_name is not None:
+        stmt = stmt.where(Brand.brand_name == brand_name)
+    return await _sum(db_processor, stmt)
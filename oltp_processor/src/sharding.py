@@ -0,0 +1,109 @@
+"""Запись в несколько postgres с шардированием по user_id.
+
+Каждый шард - отдельный DBProcessor со своим движком и пулом. Факты
+пользователя всегда попадают в один шард, справочники (category, brand,
+product) дописываются в каждый шард, куда попали ссылающиеся на них строки.
+Агрегаты и скетчи тоже считаются в каждом шарде по его строкам. brand_id и
+event_type_id выдаются каждым шардом свои, поэтому при чтении (rollups.py,
+sketches.py) строки всех шардов собираются через select_all и сводятся по
+именам, а не по id.
+"""
+
+import asyncio
+import hashlib
+import logging
+
+import config
+import data_types
+import db
+import profiler
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for(user_id: int, shard_count: int) -> int:
+    # Стабильный хэш: номер шарда не должен зависеть от процесса и версии питона
+    digest = hashlib.blake2b(user_id.to_bytes(8, "little", signed=True), digest_size=8)
+    return int.from_bytes(digest.digest(), "little") % shard_count
+
+
+class ShardedDBProcessor:
+    def __init__(self, database_urls: list[str], chunk_size: int = 1000):
+        self.shards = [db.DBProcessor(url, chunk_size) for url in database_urls]
+        self.last_timings: profiler.BatchTimings | None = None
+        self.last_records: list[data_types.DatasetRow] = []
+
+    @property
+    def async_session(self):
+        """Производные таблицы (например, product_neighbour) живут на первом шарде"""
+        return self.shards[0].async_session
+
+    async def close(self):
+        await asyncio.gather(*(shard.close() for shard in self.shards))
+
+    async def select_all(self, stmt) -> list:
+        results = await asyncio.gather(
+            *(shard.select_all(stmt) for shard in self.shards)
+        )
+        return [row for rows in results for row in rows]
+
+    def split(
+        self, records: list[data_types.DatasetRow]
+    ) -> list[list[data_types.DatasetRow]]:
+        res = [[] for _ in self.shards]
+        for r in records:
+            res[shard_for(r.user_id, len(self.shards))].append(r)
+        return res
+
+    async def insert_batch(self, records: list[tuple[str, bytes]]):
+        self.last_records = []
+        if not records:
+            return 0, 0
+        timings = profiler.BatchTimings(len(records))
+        with timings.stage("parse", len(records)):
+            parsed_records, parsing_errors_cnt = db.DBProcessor.parse_records(records)
+        with timings.stage("split", len(parsed_records)):
+            parts = self.split(parsed_records)
+
+        # Если упал хотя бы один шард, батч повторяется целиком: вставки идемпотентны.
+        # Остальные шарды отменяются до выхода, чтобы ретрай не пересекся с ними
+        shard_timings = [profiler.BatchTimings(len(part)) for part in parts]
+        try:
+            with timings.stage("shards") as shards_stage:
+                async with asyncio.TaskGroup() as group:
+                    tasks = [
+                        group.create_task(shard.insert_rows(part, part_timings))
+                        for shard, part, part_timings in zip(
+                            self.shards, parts, shard_timings
+                        )
+                    ]
+        except ExceptionGroup as e:
+            # Наружу - ошибка шарда, как у несшардированного процессора
+            raise e.exceptions[0] from e
+        finally:
+            # И после ошибки или отмены по таймауту: отчет покажет, какой шард тормозил
+            for i, (part, part_timings) in enumerate(zip(parts, shard_timings)):
+                timings.stages.append(
+                    profiler.Stage(
+                        f"shard{i}",
+                        part_timings.total,
+                        len(part),
+                        shards_stage.started,
+                    )
+                )
+            self.last_timings = timings
+
+        self.last_records = parsed_records
+        success_cnt = sum(task.result() for task in tasks)
+        return success_cnt, parsing_errors_cnt + len(parsed_records) - success_cnt
+
+
+def create_processor(database_url: str | None = None, chunk_size: int = 1000):
+    """Шардированный процессор, если в конфиге больше одного шарда"""
+    if database_url:
+        return db.DBProcessor(database_url, chunk_size)
+    urls = config.build_shard_urls()
+    if len(urls) == 1:
+        return db.DBProcessor(urls[0], chunk_size)
+    logger.info(f"Writing to {len(urls)} shards")
+    return ShardedDBProcessor(urls, chunk_size)
@@ -0,0 +1,194 @@
+"""Вероятностные структуры для фичей, которые дорого считать точно.
+
+HyperLogLog - число уникальных пользователей, count-min + top-K - самые
+популярные товары. Обе структуры занимают фиксированную память, сливаются
+без потерь (``merge``) и сериализуются в bytea. Хелперы чтения принимают
+DBProcessor или ShardedDBProcessor и сливают скетчи всех шардов.
+"""
+
+import array
+import datetime as dt
+import hashlib
+import math
+import struct
+
+from sqlalchemy import select
+
+from models import Brand, BrandUsersSketch, CategoryUsersSketch, HotProductsSketch
+
+
+def hash64(value) -> int:
+    digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class HyperLogLog:
+    def __init__(self, p: int = 12, registers: bytearray | None = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value):
+        h = hash64(value)
+        idx = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = 64 - self.p - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.p != self.p:
+            raise ValueError(f"Cannot merge HLL with p={other.p} into p={self.p}")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m**2 / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # На малых мощностях linear counting точнее
+            estimate = self.m * math.log(self.m / zeros)
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.p]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        return cls(data[0], bytearray(data[1:]))
+
+
+class CountMinSketch:
+    def __init__(self, width: int = 2048, depth: int = 4, counts=None):
+        self.width = width
+        self.depth = depth
+        self.counts = counts if counts is not None else array.array("I")
+        if counts is None:
+            self.counts.frombytes(bytes(4 * width * depth))
+
+    def _cells(self, value):
+        # double hashing: h1 + i * h2 вместо depth независимых хэшей
+        h = hash64(value)
+        h1, h2 = h & 0xFFFFFFFF, h >> 32
+        for i in range(self.depth):
+            yield i * self.width + (h1 + i * h2) % self.width
+
+    def add(self, value, count: int = 1) -> int:
+        estimate = None
+        for cell in self._cells(value):
+            self.counts[cell] += count
+            current = self.counts[cell]
+            estimate = current if estimate is None else min(estimate, current)
+        return estimate
+
+    def estimate(self, value) -> int:
+        return min(self.counts[cell] for cell in self._cells(value))
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge count-min sketches of different shape")
+        self.counts = array.array("I", map(sum, zip(self.counts, other.counts)))
+        return self
+
+
+class TopK:
+    """Count-min плюс кандидаты в top-K, оценки берутся из count-min"""
+
+    _HEADER = struct.Struct("<HHH")
+
+    def __init__(self, k: int = 100, cms: CountMinSketch | None = None):
+        self.k = k
+        self.cms = cms if cms is not None else CountMinSketch()
+        self.candidates: dict[int, int] = {}
+
+    def _trim(self):
+        # Держим до 2k кандидатов, чтобы не пересортировывать на каждом add
+        if len(self.candidates) > 2 * self.k:
+            self.candidates = dict(self.top())
+
+    def add(self, key: int, count: int = 1):
+        self.candidates[key] = self.cms.add(key, count)
+        self._trim()
+
+    def merge(self, other: "TopK") -> "TopK":
+        self.cms.merge(other.cms)
+        keys = self.candidates.keys() | other.candidates.keys()
+        self.candidates = {key: self.cms.estimate(key) for key in keys}
+        self._trim()
+        return self
+
+    def top(self, k: int | None = None) -> list[tuple[int, int]]:
+        items = sorted(self.candidates.items(), key=lambda kv: (-kv[1], kv[0]))
+        return items[: k or self.k]
+
+    def to_bytes(self) -> bytes:
+        keys = [key for key, _ in self.top()]
+        return (
+            self._HEADER.pack(self.cms.width, self.cms.depth, self.k)
+            + self.cms.counts.tobytes()
+            + struct.pack(f"<{len(keys)}q", *keys)
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TopK":
+        width, depth, k = cls._HEADER.unpack_from(data)
+        offset = cls._HEADER.size
+        counts = array.array("I")
+        counts.frombytes(data[offset : offset + 4 * width * depth])
+        offset += 4 * width * depth
+        res = cls(k, CountMinSketch(width, depth, counts))
+        keys = struct.unpack(f"<{(len(data) - offset) // 8}q", data[offset:])
+        res.candidates = {key: res.cms.estimate(key) for key in keys}
+        return res
+
+
+async def _merge_users(db_processor, stmt) -> int:
+    hll = None
+    for (data,) in await db_processor.select_all(stmt):
+        sketch = HyperLogLog.from_bytes(data)
+        hll = sketch if hll is None else hll.merge(sketch)
+    return hll.count() if hll is not None else 0
+
+
+async def category_unique_users(
+    db_processor, category_id: str, start: dt.date, end: dt.date
+) -> int:
+    """Оценка числа уникальных пользователей категории за дни [start, end]"""
+    stmt = select(CategoryUsersSketch.sketch).where(
+        CategoryUsersSketch.category_id == category_id,
+        CategoryUsersSketch.day >= start,
+        CategoryUsersSketch.day <= end,
+    )
+    return await _merge_users(db_processor, stmt)
+
+
+async def brand_unique_users(
+    db_processor, brand_name: str, start: dt.date, end: dt.date
+) -> int:
+    """Оценка числа уникальных пользователей бренда за дни [start, end]"""
+    # brand_id в каждом шарде свой
+    stmt = (
+        select(BrandUsersSketch.sketch)
+        .join(Brand, Brand.brand_id == BrandUsersSketch.brand_id)
+        .where(
+            Brand.brand_name == brand_name,
+            BrandUsersSketch.day >= start,
+            BrandUsersSketch.day <= end,
+        )
+    )
+    return await _merge_users(db_processor, stmt)
+
+
+async def hot_products(
+    db_processor, start: dt.datetime, end: dt.datetime, k: int = 10
+) -> list[tuple[int, int]]:
+    """Top-k товаров по числу событий за часы [start, end)"""
+    stmt = select(HotProductsSketch.sketch).where(
+        HotProductsSketch.hour >= start, HotProductsSketch.hour < end
+    )
+    merged = None
+    for (data,) in await db_processor.select_all(stmt):
+        sketch = TopK.from_bytes(data)
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged.top(k) if merged is not None else []
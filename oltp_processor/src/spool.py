@@ -0,0 +1,169 @@
+"""Локальный спул батчей на диске на время, пока postgres недоступен.
+
+Батчи дописываются в сегменты ``<номер>.seg``. Каждая запись в сегменте:
+
+    uint32 длина, uint32 crc32, затем сообщения батча:
+    uint32 число сообщений, для каждого uint8 длина формата + формат,
+    uint32 длина + значение
+
+После ``append`` запись уже на диске (fsync), так что оффсеты можно коммитить.
+Дренер читает сегменты через mmap, по порядку, и удаляет сегмент после того,
+как все его батчи записаны в БД. Вставки идемпотентны, поэтому повтор
+сегмента после падения безопасен. Батчи, которые БД отвергает не из-за
+сбоя, откладываются в ``dead/`` в том же формате для ручного разбора.
+"""
+
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import zlib
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_RECORD = struct.Struct("<II")
+_U8 = struct.Struct("<B")
+_U32 = struct.Struct("<I")
+
+
+def encode_batch(batch: list[tuple[str, bytes]]) -> bytes:
+    parts = [_U32.pack(len(batch))]
+    for fmt, value in batch:
+        fmt = fmt.encode("ascii")
+        parts.append(_U8.pack(len(fmt)))
+        parts.append(fmt)
+        parts.append(_U32.pack(len(value)))
+        parts.append(value)
+    return b"".join(parts)
+
+
+def write_record(f, batch: list[tuple[str, bytes]]):
+    payload = encode_batch(batch)
+    f.write(_RECORD.pack(len(payload), zlib.crc32(payload)))
+    f.write(payload)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _append_record(path: Path, batch: list[tuple[str, bytes]]):
+    with open(path, "ab") as f:
+        write_record(f, batch)
+
+
+def decode_batch(data) -> list[tuple[str, bytes]]:
+    (count,) = _U32.unpack_from(data)
+    offset = _U32.size
+    batch = []
+    for _ in range(count):
+        (size,) = _U8.unpack_from(data, offset)
+        offset += _U8.size
+        fmt = bytes(data[offset : offset + size]).decode("ascii")
+        offset += size
+        (size,) = _U32.unpack_from(data, offset)
+        offset += _U32.size
+        batch.append((fmt, bytes(data[offset : offset + size])))
+        offset += size
+    return batch
+
+
+class Spool:
+    def __init__(self, directory: str | Path, segment_bytes: int = 64 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dead_directory = self.directory / "dead"
+        self.segment_bytes = segment_bytes
+        self._active = None
+        self._active_path: Path | None = None
+        # Запись идет в потоке, дренер не должен закрыть сегмент посреди нее
+        self._lock = asyncio.Lock()
+
+        # Размеры сегментов держим в памяти, чтобы не обходить папку на каждом
+        # батче. Сегменты с прошлого запуска будут дозалиты дренером
+        self._sizes = {
+            path: path.stat().st_size for path in sorted(self.directory.glob("*.seg"))
+        }
+        self._depth = sum(self._sizes.values())
+        segments = self.segments()
+        self._next_seq = int(segments[-1].stem) + 1 if segments else 0
+        if segments:
+            logger.warning(f"Found {len(segments)} spool segments from previous run")
+
+    def segments(self) -> list[Path]:
+        return sorted(self._sizes)
+
+    @property
+    def depth(self) -> int:
+        """Сколько байт ждет записи в БД"""
+        return self._depth
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._sizes)
+
+    async def append(self, batch: list[tuple[str, bytes]]):
+        # write + fsync в потоке: event loop тем временем шлет хартбиты кафки
+        async with self._lock:
+            if self._active is None:
+                self._active_path = self.directory / f"{self._next_seq:010d}.seg"
+                self._active = open(self._active_path, "ab")
+                self._sizes[self._active_path] = 0
+                self._next_seq += 1
+            await asyncio.to_thread(write_record, self._active, batch)
+            size = self._active.tell()
+            self._depth += size - self._sizes[self._active_path]
+            self._sizes[self._active_path] = size
+            if size >= self.segment_bytes:
+                self.seal()
+
+    def seal(self):
+        """Закрывает текущий сегмент, следующий append начнет новый"""
+        if self._active is not None:
+            self._active.close()
+            self._active = None
+            self._active_path = None
+
+    async def next_segment(self) -> Path | None:
+        """Самый старый сегмент для дренера, текущий запечатывается при необходимости"""
+        async with self._lock:
+            segments = self.segments()
+            if not segments:
+                return None
+            if segments[0] == self._active_path:
+                self.seal()
+            return segments[0]
+
+    @staticmethod
+    def read(path: Path):
+        """Батчи сегмента; недописанный хвост после падения пропускается"""
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset = 0
+                while offset + _RECORD.size <= len(data):
+                    size, crc = _RECORD.unpack_from(data, offset)
+                    start = offset + _RECORD.size
+                    payload = data[start : start + size]
+                    if len(payload) < size or zlib.crc32(payload) != crc:
+                        logger.error(
+                            f"Truncated or corrupt record in {path} at {offset}"
+                        )
+                        return
+                    yield decode_batch(payload)
+                    offset = start + size
+
+    def remove(self, path: Path):
+        path.unlink()
+        self._depth -= self._sizes.pop(path, 0)
+
+    async def dead_letter(self, path: Path, batch: list[tuple[str, bytes]]) -> Path:
+        """Откладывает батч сегмента ``path`` в ``dead/<имя сегмента>``"""
+        self.dead_directory.mkdir(exist_ok=True)
+        dead_path = self.dead_directory / path.name
+        await asyncio.to_thread(_append_record, dead_path, batch)
+        return dead_path
+
+    def close(self):
+        self.seal()
@@ -0,0 +1,159 @@
+"""Лента событий пользователя: event и purchase вместе, от новых к старым.
+
+Пагинация по ключу (event_time, id): следующая страница начинается строго
+после последней записи предыдущей, так что глубина листания не влияет на
+стоимость запроса. Каждая ветка UNION читает только покрывающий индекс
+(user_id, event_time, id) INCLUDE (...).
+
+Первая страница горячих пользователей кэшируется в памяти на cache_ttl секунд.
+"""
+
+import datetime as dt
+import decimal
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy import SmallInteger, cast, literal, null, select, tuple_, union_all
+
+import sharding
+from models import Event, EventType, Purchase
+
+Cursor = tuple[dt.datetime, uuid.UUID]
+
+
+@dataclass
+class TimelineEntry:
+    event_time: dt.datetime
+    id: uuid.UUID
+    event_type: str
+    product_id: int
+    price: decimal.Decimal
+    user_session: uuid.UUID
+
+    @property
+    def cursor(self) -> Cursor:
+        return self.event_time, self.id
+
+
+@dataclass
+class TimelinePage:
+    entries: list[TimelineEntry]
+    next_cursor: Cursor | None
+
+
+def _branch(model, event_type_id, user_id: int, before: Cursor | None, limit: int):
+    stmt = select(
+        model.event_time,
+        model.id,
+        event_type_id.label("event_type_id"),
+        model.product_id,
+        model.price,
+        model.user_session,
+    ).where(model.user_id == user_id)
+    if before is not None:
+        event_time, id_ = before
+        stmt = stmt.where(
+            tuple_(model.event_time, model.id)
+            < tuple_(
+                literal(event_time, model.event_time.type),
+                literal(id_, model.id.type),
+            )
+        )
+    return stmt.order_by(model.event_time.desc(), model.id.desc()).limit(limit)
+
+
+def timeline_query(user_id: int, limit: int, before: Cursor | None = None):
+    merged = union_all(
+        _branch(Event, Event.event_type_id, user_id, before, limit),
+        # у покупок типа нет, это всегда purchase
+        _branch(Purchase, cast(null(), SmallInteger), user_id, before, limit),
+    ).subquery()
+    return (
+        select(merged)
+        .order_by(merged.c.event_time.desc(), merged.c.id.desc())
+        .limit(limit)
+    )
+
+
+class TimelineService:
+    def __init__(
+        self,
+        db_processor,
+        cache_users: int = 10_000,
+        cache_ttl: float = 5.0,
+        cache_depth: int = 100,
+    ):
+        self.db_processor = db_processor
+        self.cache_users = cache_users
+        self.cache_ttl = cache_ttl
+        self.cache_depth = cache_depth
+        self.cache: OrderedDict[int, tuple[float, list[TimelineEntry]]] = OrderedDict()
+        # event_type_id у каждого шарда свои
+        self.event_types: dict[int, dict[int, str]] = {}
+
+    def _shard(self, user_id: int) -> int:
+        shards = getattr(self.db_processor, "shards", None)
+        return sharding.shard_for(user_id, len(shards)) if shards else 0
+
+    def _session(self, shard: int):
+        shards = getattr(self.db_processor, "shards", None)
+        processor = shards[shard] if shards else self.db_processor
+        return processor.async_session()
+
+    async def _fetch(
+        self, user_id: int, limit: int, before: Cursor | None
+    ) -> list[TimelineEntry]:
+        shard = self._shard(user_id)
+        async with self._session(shard) as session:
+            rows = (await session.execute(timeline_query(user_id, limit, before))).all()
+            mapping = self.event_types.get(shard, {})
+            unknown = {r.event_type_id for r in rows} - mapping.keys() - {None}
+            if unknown or shard not in self.event_types:
+                result = await session.execute(
+                    select(EventType.event_type_id, EventType.event_type_name)
+                )
+                mapping = self.event_types[shard] = dict(result.all())
+        return [
+            TimelineEntry(
+                event_time=r.event_time,
+                id=r.id,
+                event_type=(
+                    "purchase" if r.event_type_id is None else mapping[r.event_type_id]
+                ),
+                product_id=r.product_id,
+                price=r.price,
+                user_session=r.user_session,
+            )
+            for r in rows
+        ]
+
+    def _cached(self, user_id: int) -> list[TimelineEntry] | None:
+        item = self.cache.get(user_id)
+        if item is None:
+            return None
+        fetched_at, entries = item
+        if time.monotonic() - fetched_at > self.cache_ttl:
+            del self.cache[user_id]
+            return None
+        self.cache.move_to_end(user_id)
+        return entries
+
+    async def get_timeline(
+        self, user_id: int, limit: int = 50, cursor: Cursor | None = None
+    ) -> TimelinePage:
+        """Страница ленты; cursor - next_cursor предыдущей страницы"""
+        if cursor is None and limit <= self.cache_depth:
+            entries = self._cached(user_id)
+            if entries is None:
+                entries = await self._fetch(user_id, self.cache_depth, None)
+                self.cache[user_id] = (time.monotonic(), entries)
+                if len(self.cache) > self.cache_users:
+                    self.cache.popitem(last=False)
+            entries = entries[:limit]
+        else:
+            entries = await self._fetch(user_id, limit, cursor)
+
+        next_cursor = entries[-1].cursor if len(entries) == limit else None
+        return TimelinePage(entries, next_cursor)
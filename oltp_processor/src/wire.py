@@ -0,0 +1,158 @@
+"""Форматы сообщений в топике.
+
+Формат выбирается по заголовку ``format`` у каждого сообщения, без заголовка
+считаем, что это JSON (так пишет data_producer).
+
+Бинарный формат ``struct`` - фиксированная часть плюс три строки с префиксом длины:
+
+    event_time   int64   микросекунды от эпохи, UTC
+    product_id   int64
+    user_id      int64
+    price        int64   в копейках (центах)
+    user_session 16 байт
+    row_id       16 байт
+    event_type   uint8   индекс в data_types.EVENT_TYPES
+    category_id, category_code, brand: uint16 длина + utf-8
+"""
+
+import datetime as dt
+import decimal
+import json
+import struct
+import uuid
+
+import data_types
+
+FORMAT_HEADER = "format"
+FORMAT_JSON = "json"
+FORMAT_STRUCT = "struct"
+# Заголовок задает продюсер: неизвестное значение не должно ронять чтение,
+# такие сообщения считаются ошибками разбора в DBProcessor.parse_records
+FORMAT_UNKNOWN = "unknown"
+
+_FIXED = struct.Struct("<qqqq16s16sB")
+_STR_LEN = struct.Struct("<H")
+_EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+_CENT = decimal.Decimal("0.01")
+
+
+# Известные форматы отдаем одними и теми же строками, а не новой на сообщение
+_KNOWN_FORMATS = {
+    FORMAT_JSON.encode(): FORMAT_JSON,
+    FORMAT_STRUCT.encode(): FORMAT_STRUCT,
+}
+
+
+def message_format(headers) -> str:
+    """Достает формат из заголовков кафки, по умолчанию JSON"""
+    for key, value in headers or ():
+        if key == FORMAT_HEADER and value:
+            return _KNOWN_FORMATS.get(bytes(value), FORMAT_UNKNOWN)
+    return FORMAT_JSON
+
+
+def _to_micros(value: dt.datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt.timezone.utc)
+    return (value - _EPOCH) // dt.timedelta(microseconds=1)
+
+
+def _to_cents(value: decimal.Decimal) -> int:
+    cents = value.quantize(_CENT)
+    if cents != value:
+        raise ValueError(f"Price {value} has more than 2 decimal places")
+    return int(cents.scaleb(2))
+
+
+def _pack_str(value: str | None) -> bytes:
+    data = (value or "").encode("utf-8")
+    return _STR_LEN.pack(len(data)) + data
+
+
+def encode_struct(row: data_types.DatasetRow) -> bytes:
+    fixed = _FIXED.pack(
+        _to_micros(row.event_time),
+        row.product_id,
+        row.user_id,
+        _to_cents(row.price),
+        row.user_session.bytes,
+        row.row_id.bytes,
+        data_types.EVENT_TYPES.index(row.event_type),
+    )
+    return (
+        fixed
+        + _pack_str(row.category_id)
+        + _pack_str(row.category_code)
+        + _pack_str(row.brand)
+    )
+
+
+def decode_struct(value: bytes) -> data_types.DatasetRow:
+    (
+        micros,
+        product_id,
+        user_id,
+        cents,
+        user_session,
+        row_id,
+        event_type,
+    ) = _FIXED.unpack_from(value)
+    offset = _FIXED.size
+    strings = []
+    for _ in range(3):
+        (size,) = _STR_LEN.unpack_from(value, offset)
+        offset += _STR_LEN.size
+        strings.append(bytes(value[offset : offset + size]).decode("utf-8"))
+        offset += size
+    if offset != len(value):
+        raise ValueError(f"Unexpected trailing bytes: {len(value) - offset}")
+    category_id, category_code, brand = strings
+    return data_types.DatasetRow(
+        event_time=_EPOCH + dt.timedelta(microseconds=micros),
+        event_type=data_types.EVENT_TYPES[event_type],
+        product_id=product_id,
+        category_id=category_id,
+        category_code=category_code,
+        brand=brand,
+        price=decimal.Decimal(cents).scaleb(-2),
+        user_id=user_id,
+        user_session=uuid.UUID(bytes=user_session),
+        row_id=uuid.UUID(bytes=row_id),
+    )
+
+
+def encode_json(row: data_types.DatasetRow) -> bytes:
+    """То же, что отдает Go-продюсер"""
+    return json.dumps(
+        {
+            "event_time": row.event_time.isoformat(),
+            "event_type": row.event_type,
+            "product_id": row.product_id,
+            "category_id": row.category_id,
+            "category_code": row.category_code or "",
+            "brand": row.brand,
+            "price": str(row.price),
+            "user_id": row.user_id,
+            "user_session": str(row.user_session),
+            "row_id": str(row.row_id),
+        }
+    ).encode("utf-8")
+
+
+def decode_json(value: bytes) -> data_types.DatasetRow:
+    return data_types.DatasetRow.from_dict(json.loads(value))
+
+
+ENCODERS = {FORMAT_JSON: encode_json, FORMAT_STRUCT: encode_struct}
+DECODERS = {FORMAT_JSON: decode_json, FORMAT_STRUCT: decode_struct}
+
+
+def encode(row: data_types.DatasetRow, fmt: str = FORMAT_JSON) -> bytes:
+    return ENCODERS[fmt](row)
+
+
+def decode(value: bytes, fmt: str = FORMAT_JSON) -> data_types.DatasetRow:
+    decoder = DECODERS.get(fmt)
+    if decoder is None:
+        raise ValueError(f"Unknown message format: {fmt}")
+    return decoder(value)
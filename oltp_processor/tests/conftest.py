@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# Модули в src и bench импортируются плоско, как при запуске main.py
+ROOT = Path(__file__).parent.parent
+# src первым: bench/timeline.py не должен заслонять src/timeline.py
+sys.path.insert(0, str(ROOT / "bench"))
+sys.path.insert(0, str(ROOT / "src"))
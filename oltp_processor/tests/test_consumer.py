@@ -0,0 +1,186 @@
+import asyncio
+
+import pytest
+
+import consumer
+import spool
+from test_spool import make_batch
+
+
+class FlakyProcessor:
+    """Отвергает батчи заданного размера, остальные записывает"""
+
+    def __init__(self, bad_size: int, error: Exception):
+        self.bad_size = bad_size
+        self.error = error
+        self.written = []
+        self.last_records = []
+
+    async def insert_batch(self, batch):
+        if len(batch) == self.bad_size:
+            raise self.error
+        self.written.append(batch)
+        return len(batch), 0
+
+
+async def drain(kafka_consumer, until):
+    task = asyncio.create_task(kafka_consumer._drain(interval=0))
+    # Мертвые письма пишутся в потоке, поэтому ждем по времени, а не по итерациям
+    for _ in range(500):
+        await asyncio.sleep(0.001)
+        if until():
+            break
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def make_consumer(tmp_path, processor):
+    kafka_consumer = consumer.KafkaConsumer(
+        "localhost", 9092, "events", spool_dir=tmp_path, dead_letter_errors=3
+    )
+    kafka_consumer.spool = spool.Spool(tmp_path)
+    kafka_consumer.drain_processor = processor
+    for n in (2, 5, 3):
+        asyncio.run(kafka_consumer.spool.append(make_batch(n)))
+    return kafka_consumer
+
+
+def test_rejected_batch_is_dead_lettered(tmp_path):
+    processor = FlakyProcessor(5, ValueError("numeric field overflow"))
+    kafka_consumer = make_consumer(tmp_path, processor)
+    asyncio.run(drain(kafka_consumer, lambda: not kafka_consumer.spool.pending))
+
+    assert not kafka_consumer.spool.pending
+    # Записанные до ошибки батчи не повторяются
+    assert processor.written == [make_batch(2), make_batch(3)]
+    (dead,) = (tmp_path / "dead").iterdir()
+    assert list(spool.Spool.read(dead)) == [make_batch(5)]
+
+
+def test_transient_errors_are_retried(tmp_path):
+    processor = FlakyProcessor(5, ConnectionRefusedError())
+    kafka_consumer = make_consumer(tmp_path, processor)
+    asyncio.run(drain(kafka_consumer, lambda: False))
+
+    assert kafka_consumer.spool.pending
+    assert processor.written == [make_batch(2)]
+    assert not (tmp_path / "dead").exists()
+
+
+def test_spool_is_capped(tmp_path):
+    kafka_consumer = make_consumer(tmp_path, None)
+    kafka_consumer.max_spool_bytes = kafka_consumer.spool.depth
+    with pytest.raises(RuntimeError):
+        asyncio.run(kafka_consumer._spool_batch(make_batch(1)))
+
+
+class Message:
+    def __init__(self, value: bytes, headers=()):
+        self.value = value
+        self.headers = headers
+
+
+class FakeKafka:
+    """AIOKafkaConsumer с заранее заданными ответами getmany"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+        self.paused = False
+
+    def assignment(self):
+        return {"tp0", "tp1"}
+
+    def pause(self, *partitions):
+        self.calls.append(("pause", sorted(partitions)))
+        self.paused = True
+
+    def resume(self, *partitions):
+        self.calls.append(("resume", sorted(partitions)))
+        self.paused = False
+
+    async def getmany(self, timeout_ms, max_records):
+        self.calls.append("getmany")
+        # На паузе брокер ничего не отдает
+        if self.paused:
+            return {}
+        if not self.responses:
+            raise asyncio.CancelledError()
+        return self.responses.pop(0)
+
+    async def commit(self):
+        self.calls.append("commit")
+
+
+def messages(*values: bytes):
+    return {"tp0": [Message(v) for v in values]}
+
+
+def test_pauses_when_buffer_is_full():
+    kafka_consumer = consumer.KafkaConsumer(
+        "localhost", 9092, "events", max_buffer_bytes=2 * consumer.MESSAGE_OVERHEAD
+    )
+    kafka_consumer.consumer = FakeKafka([messages(b"a"), messages(b"b")])
+
+    async def run():
+        kafka_consumer.update_flow_control()
+        await kafka_consumer.get_batch()
+        kafka_consumer.update_flow_control()
+        first = list(kafka_consumer.consumer.calls)
+        await kafka_consumer.get_batch()
+        kafka_consumer.update_flow_control()
+        # Повторная пауза на каждой итерации: могли прийти новые партиции
+        kafka_consumer.update_flow_control()
+        return first
+
+    first = asyncio.run(run())
+    assert first == ["getmany"]
+    assert kafka_consumer.buffered_bytes == 2 * consumer.MESSAGE_OVERHEAD + 2
+    assert kafka_consumer.paused
+    assert kafka_consumer.consumer.calls[1:] == [
+        "getmany",
+        ("pause", ["tp0", "tp1"]),
+        ("pause", ["tp0", "tp1"]),
+    ]
+
+    kafka_consumer.buffered_bytes = 0
+    kafka_consumer.update_flow_control()
+    assert not kafka_consumer.paused
+    assert kafka_consumer.consumer.calls[-1] == ("resume", ["tp0", "tp1"])
+
+
+def test_failed_write_pauses_until_batch_is_written(monkeypatch):
+    kafka_consumer = consumer.KafkaConsumer("localhost", 9092, "events", batch_size=2)
+    fake = kafka_consumer.consumer = FakeKafka([messages(b"a", b"b")])
+    written = []
+
+    async def write_batch(batch):
+        written.append(list(batch))
+        fake.calls.append("write")
+        if len(written) == 1:
+            raise ConnectionRefusedError()
+
+    async def no_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(kafka_consumer, "_write_batch", write_batch)
+    monkeypatch.setattr(consumer.asyncio, "sleep", no_sleep)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(kafka_consumer.consume())
+
+    tps = ["tp0", "tp1"]
+    assert fake.calls == [
+        "getmany",
+        "write",
+        # Сразу после ошибки, а не когда батч дорастет до бюджета
+        ("pause", tps),
+        "getmany",
+        "write",
+        "commit",
+        ("resume", tps),
+        "getmany",
+    ]
+    # Ретрай того же батча, без новых сообщений
+    assert written == [[("json", b"a"), ("json", b"b")]] * 2
+    assert kafka_consumer.buffered_bytes == 0
+    assert not kafka_consumer.write_failed
@@ -0,0 +1,113 @@
+import asyncio
+import dataclasses
+import uuid
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import cooccurrence
+from rows import random_rows
+
+
+def session_rows(session: uuid.UUID, products: list[int], event_type="view"):
+    template = random_rows(1)[0]
+    return [
+        dataclasses.replace(
+            template, user_session=session, product_id=p, event_type=event_type
+        )
+        for p in products
+    ]
+
+
+class RecordingSession:
+    def __init__(self, error: BaseException | None = None):
+        self.error = error
+        self.statements = []
+
+    async def execute(self, stmt):
+        if self.error is not None:
+            raise self.error
+        self.statements.append(stmt)
+
+    async def commit(self):
+        pass
+
+
+def test_update_counts_pairs_once_per_session():
+    index = cooccurrence.CooccurrenceIndex("viewed", {"view"})
+    first, second = uuid.uuid4(), uuid.uuid4()
+    records = session_rows(first, [1, 2, 3]) + session_rows(second, [2, 1])
+    index.update(records)
+    # Повтор батча пары не увеличивает
+    index.update(records)
+    index.update(session_rows(first, [4], event_type="purchase"))
+    assert index.pending == {(1, 2): 2, (1, 3): 1, (2, 3): 1}
+
+
+def test_products_per_session_are_capped():
+    index = cooccurrence.CooccurrenceIndex(
+        "viewed", {"view"}, max_products_per_session=3
+    )
+    index.update(session_rows(uuid.uuid4(), [1, 2, 3, 4, 5]))
+    assert set(index.pending) == {(1, 2), (1, 3), (2, 3)}
+
+
+def test_pending_is_bounded():
+    index = cooccurrence.CooccurrenceIndex("viewed", {"view"}, max_pairs=10)
+    heavy = uuid.uuid4(), uuid.uuid4()
+    for session in heavy:
+        index.update(session_rows(session, [100, 101]))
+    assert not index.full
+    index.update(session_rows(uuid.uuid4(), list(range(6))))
+    assert index.full
+    assert len(index.pending) == 10
+    assert index.pending[100, 101] == 2
+
+
+def test_flush_writes_both_directions_and_clears():
+    index = cooccurrence.CooccurrenceIndex("viewed", {"view"})
+    index.update(session_rows(uuid.uuid4(), [3, 1, 2]))
+    session = RecordingSession()
+    asyncio.run(index.flush(session))
+    assert not index.pending
+
+    upsert, trim = session.statements
+    params = upsert.compile(dialect=postgresql.dialect()).params
+    written = sorted(
+        (
+            params[f"product_id_m{i}"],
+            params[f"neighbour_id_m{i}"],
+            params[f"weight_m{i}"],
+        )
+        for i in range(6)
+    )
+    assert written == [
+        (1, 2, 1),
+        (1, 3, 1),
+        (2, 1, 1),
+        (2, 3, 1),
+        (3, 1, 1),
+        (3, 2, 1),
+    ]
+    sql = str(upsert.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (kind, product_id, neighbour_id) DO UPDATE" in sql
+    assert "DELETE FROM product_neighbour" in str(
+        trim.compile(dialect=postgresql.dialect())
+    )
+
+
+def test_failed_flush_keeps_pending():
+    index = cooccurrence.CooccurrenceIndex("viewed", {"view"})
+    index.update(session_rows(uuid.uuid4(), [1, 2]))
+    with pytest.raises(ConnectionRefusedError):
+        asyncio.run(index.flush(RecordingSession(ConnectionRefusedError())))
+    index.update(session_rows(uuid.uuid4(), [1, 2]))
+    assert index.pending == {(1, 2): 2}
+
+
+def test_cancelled_flush_keeps_pending():
+    index = cooccurrence.CooccurrenceIndex("viewed", {"view"})
+    index.update(session_rows(uuid.uuid4(), [1, 2]))
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(index.flush(RecordingSession(asyncio.CancelledError())))
+    assert index.pending == {(1, 2): 1}
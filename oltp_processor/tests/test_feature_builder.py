@@ -0,0 +1,161 @@
+import csv
+import datetime as dt
+import decimal
+import random
+
+import pytest
+
+import feature_builder
+import features
+from rows import random_rows
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+START = dt.datetime(2019, 10, 1, tzinfo=dt.timezone.utc)
+
+
+def write_partitions(path, rows):
+    """Подневные паркеты в формате split_dataset: data_<date>_<chunk>.parquet"""
+    days = {}
+    for r in rows:
+        days.setdefault(r.event_time.date(), []).append(r)
+    for day, day_rows in days.items():
+        # Два чанка на день, чтобы проверить склейку
+        for chunk in range(2):
+            part = day_rows[chunk::2]
+            table = pa.table(
+                {
+                    "event_time": [r.event_time for r in part],
+                    "event_type": [r.event_type for r in part],
+                    "price": [float(r.price) for r in part],
+                    "user_id": [r.user_id for r in part],
+                }
+            )
+            pq.write_table(table, path / f"data_{day.isoformat()}_{chunk}.parquet")
+
+
+def brute_force(rows, user_id, ts):
+    res = {}
+    for window, size in features.WINDOWS.items():
+        matched = [
+            r for r in rows if r.user_id == user_id and ts - size < r.event_time <= ts
+        ]
+        for event_type in features.data_types.EVENT_TYPES:
+            res[f"{event_type}_cnt_{window}"] = sum(
+                r.event_type == event_type for r in matched
+            )
+        res[f"spend_{window}"] = sum(
+            (r.price for r in matched if r.event_type == "purchase"),
+            decimal.Decimal(0),
+        )
+    return res
+
+
+def test_list_partitions(tmp_path):
+    for name in [
+        "data_2019-10-02_0.parquet",
+        "data_2019-10-01_1.parquet",
+        "data_2019-10-01_0.parquet",
+        "broken.parquet",
+        "notes.txt",
+    ]:
+        (tmp_path / name).touch()
+    partitions = feature_builder.list_partitions(tmp_path)
+    assert {day: [p.name for p in paths] for day, paths in partitions.items()} == {
+        dt.date(2019, 10, 1): [
+            "data_2019-10-01_0.parquet",
+            "data_2019-10-01_1.parquet",
+        ],
+        dt.date(2019, 10, 2): ["data_2019-10-02_0.parquet"],
+    }
+
+
+def test_build_day_matches_brute_force(tmp_path):
+    rows = random_rows(3_000, users=20, start=START, span=dt.timedelta(days=10))
+    write_partitions(tmp_path, rows)
+    partitions = feature_builder.list_partitions(tmp_path)
+
+    rnd = random.Random(1)
+    day = dt.date(2019, 10, 9)
+    day_start = dt.datetime.combine(day, dt.time(), dt.timezone.utc)
+    users = sorted({r.user_id for r in rows})
+    # Плюс пользователь без событий
+    users.append(users[-1] + 1)
+    labels = [
+        (rnd.choice(users), day_start + dt.timedelta(seconds=rnd.uniform(0, 86400)))
+        for _ in range(50)
+    ]
+    # Границы окон: событие ровно в момент метки входит, ровно w назад - нет
+    for r in rows:
+        if r.event_time.date() == day:
+            labels.append((r.user_id, r.event_time))
+            labels.append((r.user_id, r.event_time + dt.timedelta(hours=1)))
+            break
+
+    built = feature_builder.build_day(day, labels, partitions)
+    assert len(built) == len(labels)
+    expected = sorted(
+        (
+            {"user_id": u, "timestamp": ts} | brute_force(rows, u, ts)
+            for u, ts in labels
+        ),
+        key=lambda row: (row["timestamp"], row["user_id"]),
+    )
+    built.sort(key=lambda row: (row["timestamp"], row["user_id"]))
+    assert built == expected
+    assert any(row["view_cnt_1h"] for row in built)
+    assert any(row["spend_7d"] for row in built)
+
+
+def write_labels(path, labels):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["user_id", "timestamp"])
+        for user_id, ts in labels:
+            writer.writerow([user_id, ts.isoformat()])
+
+
+def test_read_labels_groups_days(tmp_path):
+    labels = [
+        (1, START),
+        (2, START + dt.timedelta(hours=5)),
+        (1, START + dt.timedelta(days=2)),
+    ]
+    write_labels(tmp_path / "labels.csv", labels)
+    assert list(feature_builder.read_labels(tmp_path / "labels.csv")) == [
+        (START.date(), labels[:2]),
+        (labels[2][1].date(), labels[2:]),
+    ]
+
+
+def test_read_labels_requires_sorted_days(tmp_path):
+    labels = [(1, START), (1, START + dt.timedelta(days=1)), (2, START)]
+    write_labels(tmp_path / "labels.csv", labels)
+    with pytest.raises(ValueError, match="sorted"):
+        list(feature_builder.read_labels(tmp_path / "labels.csv"))
+
+
+def test_build_writes_days_in_order(tmp_path):
+    rows = random_rows(1_000, users=10, start=START, span=dt.timedelta(days=6))
+    write_partitions(tmp_path, rows)
+    users = sorted({r.user_id for r in rows})
+    # Дней больше, чем окно 2 * workers
+    labels = [
+        (users[day % len(users)], START + dt.timedelta(days=day, hours=12))
+        for day in range(6)
+    ]
+    write_labels(tmp_path / "labels.csv", labels)
+
+    output = tmp_path / "features.csv"
+    written = feature_builder.build(
+        tmp_path / "labels.csv", tmp_path, output, workers=1
+    )
+    assert written == len(labels)
+    with open(output, newline="") as f:
+        built = list(csv.DictReader(f))
+    assert [(int(r["user_id"]), r["timestamp"]) for r in built] == [
+        (u, str(ts)) for u, ts in labels
+    ]
+    for r, (u, ts) in zip(built, labels):
+        assert int(r["view_cnt_7d"]) == brute_force(rows, u, ts)["view_cnt_7d"]
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import db
+import profiler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_stages_and_total(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(profiler.time, "perf_counter", clock)
+    timings = profiler.BatchTimings(100)
+    assert timings.total == 0.0
+
+    with timings.stage("parse", 100):
+        clock.now += 0.5
+    with pytest.raises(RuntimeError):
+        with timings.stage("events", 90):
+            clock.now += 1.0
+            raise RuntimeError("boom")
+    # Стадия шарда, начатая вместе с events, но закончившаяся позже
+    timings.stages.append(profiler.Stage("shard0", 2.0, 90, 0.5))
+
+    assert [(s.name, s.seconds, s.rows) for s in timings.stages] == [
+        ("parse", 0.5, 100),
+        ("events", 1.0, 90),
+        ("shard0", 2.0, 90),
+    ]
+    # Стена от начала первой стадии до конца последней, без двойного счета
+    assert timings.total == 2.5
+
+
+def test_statements_and_report():
+    timings = profiler.BatchTimings(10)
+    # До первой стадии запросы не к чему привязать
+    timings.add_statement("SELECT 1", None)
+    with timings.stage("users"):
+        timings.add_statement("INSERT INTO users VALUES ($1), ($2)", (1, 2))
+    with timings.stage("commit"):
+        timings.add_statement("COMMIT", None)
+
+    assert timings.stages[0].statements == [(35, 2)]
+    assert timings.stages[1].statements == [(6, 0)]
+    lines = timings.report().splitlines()
+    assert lines[0].startswith("Slow batch: 10 messages in ")
+    assert lines[1].split()[0] == "users"
+    assert "sql=35B params=2" in lines[1]
+    assert "sql=6B params=0" in lines[2]
+
+
+def busy(seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sum(range(1000))
+
+
+def test_sampling_profiler_writes_collapsed_stacks(tmp_path):
+    sampler = profiler.SamplingProfiler(tmp_path / "profiles", interval=0.001)
+    assert sampler.start(0.2)
+    assert not sampler.start(0.2)
+    busy(0.3)
+    sampler._thread.join()
+
+    (path,) = (tmp_path / "profiles").glob("profile-*.collapsed")
+    lines = path.read_text().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+    assert any("busy (test_profiler.py)" in line for line in lines)
+
+
+def test_statements_are_recorded_per_connection():
+    engine = create_engine("sqlite://")
+    timings = profiler.BatchTimings(1)
+    with engine.connect() as mine, engine.connect() as other:
+        with timings.stage("users"), db.record_statements(mine, timings):
+            mine.execute(text("SELECT 1"))
+            other.execute(text("SELECT 22"))
+        mine.execute(text("SELECT 333"))
+    assert timings.stages[0].statements == [(8, 0)]
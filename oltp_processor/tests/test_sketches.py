@@ -0,0 +1,97 @@
+import random
+
+import pytest
+
+import sketches
+
+
+def make_hll(values) -> sketches.HyperLogLog:
+    hll = sketches.HyperLogLog()
+    for value in values:
+        hll.add(value)
+    return hll
+
+
+@pytest.mark.parametrize("n", [10, 1_000, 50_000])
+def test_hll_count(n):
+    hll = make_hll(range(n))
+    # Повторы не меняют оценку
+    for value in range(0, n, 3):
+        hll.add(value)
+    # Стандартная ошибка при p=12 около 1.6%
+    assert abs(hll.count() - n) <= max(1, 0.05 * n)
+
+
+def test_hll_merge_is_union():
+    a = make_hll(range(0, 30_000))
+    b = make_hll(range(20_000, 50_000))
+    merged = sketches.HyperLogLog.from_bytes(a.to_bytes()).merge(b)
+    assert merged.registers == make_hll(range(50_000)).registers
+    assert abs(merged.count() - 50_000) <= 0.05 * 50_000
+    # Повторное слияние ничего не меняет
+    assert merged.merge(b).registers == make_hll(range(50_000)).registers
+
+
+def test_hll_bytes_roundtrip():
+    hll = make_hll(range(1_000))
+    restored = sketches.HyperLogLog.from_bytes(hll.to_bytes())
+    assert restored.p == hll.p
+    assert restored.registers == hll.registers
+    assert restored.count() == hll.count()
+
+
+def test_hll_merge_precision_mismatch():
+    with pytest.raises(ValueError):
+        sketches.HyperLogLog(12).merge(sketches.HyperLogLog(10))
+
+
+def test_cms_merge_shape_mismatch():
+    with pytest.raises(ValueError):
+        sketches.CountMinSketch(2048, 4).merge(sketches.CountMinSketch(1024, 4))
+
+
+def zipf_stream(n: int, seed: int) -> list[int]:
+    rnd = random.Random(seed)
+    return [int(rnd.paretovariate(1.2)) for _ in range(n)]
+
+
+def test_topk_finds_heavy_hitters():
+    stream = zipf_stream(20_000, 1)
+    topk = sketches.TopK(k=10)
+    for key in stream:
+        topk.add(key)
+    exact = sorted(
+        ((key, stream.count(key)) for key in set(stream)), key=lambda kv: -kv[1]
+    )
+    top = topk.top()
+    assert [key for key, _ in top[:5]] == [key for key, _ in exact[:5]]
+    # Count-min только завышает
+    counts = dict(exact)
+    assert all(estimate >= counts[key] for key, estimate in top)
+    assert [estimate for _, estimate in top] == sorted(
+        (estimate for _, estimate in top), reverse=True
+    )
+
+
+def test_topk_bytes_roundtrip():
+    topk = sketches.TopK(k=10)
+    for key in zipf_stream(5_000, 2):
+        topk.add(key)
+    restored = sketches.TopK.from_bytes(topk.to_bytes())
+    assert restored.k == topk.k
+    assert restored.cms.counts == topk.cms.counts
+    assert restored.top() == topk.top()
+
+
+def test_topk_merge():
+    first, second = zipf_stream(10_000, 3), zipf_stream(10_000, 4)
+    a, b, whole = sketches.TopK(k=10), sketches.TopK(k=10), sketches.TopK(k=10)
+    for key in first:
+        a.add(key)
+        whole.add(key)
+    for key in second:
+        b.add(key)
+        whole.add(key)
+    merged = sketches.TopK.from_bytes(a.to_bytes()).merge(b)
+    assert merged.cms.counts == whole.cms.counts
+    assert merged.top(5) == whole.top(5)
@@ -0,0 +1,117 @@
+import asyncio
+import zlib
+
+import spool
+import wire
+from rows import random_rows
+
+
+def make_batch(n: int, seed: int = 42) -> list[tuple[str, bytes]]:
+    return [
+        (wire.FORMAT_STRUCT, wire.encode(row, wire.FORMAT_STRUCT))
+        for row in random_rows(n, seed)
+    ]
+
+
+def test_batch_roundtrip():
+    batch = make_batch(10) + [(wire.FORMAT_JSON, b"")]
+    assert spool.decode_batch(spool.encode_batch(batch)) == batch
+
+
+def test_segments_rotate_and_read_in_order(tmp_path):
+    s = spool.Spool(tmp_path, segment_bytes=1024)
+    batches = [make_batch(10, seed) for seed in range(5)]
+    for batch in batches:
+        asyncio.run(s.append(batch))
+    s.close()
+    segments = s.segments()
+    assert len(segments) == 5
+    assert [b for path in segments for b in s.read(path)] == batches
+
+    # Нумерация продолжается после перезапуска
+    s = spool.Spool(tmp_path)
+    asyncio.run(s.append(batches[0]))
+    s.close()
+    assert s.segments()[-1].name == "0000000005.seg"
+
+
+def test_next_segment_seals_active(tmp_path):
+    s = spool.Spool(tmp_path)
+    asyncio.run(s.append(make_batch(3)))
+    segment = asyncio.run(s.next_segment())
+    asyncio.run(s.append(make_batch(3, seed=1)))
+    s.close()
+    assert len(s.segments()) == 2
+    assert list(s.read(segment)) == [make_batch(3)]
+    s.remove(segment)
+    assert asyncio.run(s.next_segment()) == s.segments()[0]
+
+
+def test_truncated_tail_is_skipped(tmp_path):
+    s = spool.Spool(tmp_path)
+    asyncio.run(s.append(make_batch(5)))
+    asyncio.run(s.append(make_batch(5, seed=1)))
+    s.close()
+    (path,) = s.segments()
+    data = path.read_bytes()
+    path.write_bytes(data[:-7])
+    assert list(s.read(path)) == [make_batch(5)]
+
+    # Обрыв внутри заголовка записи
+    first = spool._RECORD.size + len(spool.encode_batch(make_batch(5)))
+    path.write_bytes(data[: first + 3])
+    assert list(s.read(path)) == [make_batch(5)]
+
+
+def test_corrupt_record_stops_reading(tmp_path):
+    s = spool.Spool(tmp_path)
+    for seed in range(3):
+        asyncio.run(s.append(make_batch(5, seed)))
+    s.close()
+    (path,) = s.segments()
+    data = bytearray(path.read_bytes())
+    first = spool._RECORD.size + len(spool.encode_batch(make_batch(5, 0)))
+    data[first + spool._RECORD.size + 10] ^= 0xFF
+    path.write_bytes(bytes(data))
+    assert list(s.read(path)) == [make_batch(5, 0)]
+
+
+def test_empty_segment(tmp_path):
+    s = spool.Spool(tmp_path)
+    path = tmp_path / "0000000000.seg"
+    path.touch()
+    assert list(s.read(path)) == []
+
+
+def test_dead_letter(tmp_path):
+    s = spool.Spool(tmp_path)
+    asyncio.run(s.append(make_batch(5)))
+    segment = asyncio.run(s.next_segment())
+    dead = asyncio.run(s.dead_letter(segment, make_batch(5)))
+    asyncio.run(s.dead_letter(segment, make_batch(2, seed=1)))
+    assert dead == tmp_path / "dead" / segment.name
+    assert s.segments() == [segment]
+    assert list(s.read(dead)) == [make_batch(5), make_batch(2, seed=1)]
+    payload = spool.encode_batch(make_batch(5))
+    header = spool._RECORD.pack(len(payload), zlib.crc32(payload))
+    assert dead.read_bytes().startswith(header + payload)
+
+
+def test_depth_is_tracked_in_memory(tmp_path):
+    s = spool.Spool(tmp_path, segment_bytes=1024)
+    assert not s.pending and s.depth == 0
+    for seed in range(3):
+        asyncio.run(s.append(make_batch(10, seed)))
+    on_disk = sum(p.stat().st_size for p in tmp_path.glob("*.seg"))
+    assert s.pending and s.depth == on_disk
+
+    segment = asyncio.run(s.next_segment())
+    size = segment.stat().st_size
+    s.remove(segment)
+    assert s.depth == on_disk - size
+    s.close()
+
+    # После перезапуска размеры берутся с диска
+    restarted = spool.Spool(tmp_path)
+    assert restarted.segments() == s.segments()
+    assert restarted.depth == s.depth
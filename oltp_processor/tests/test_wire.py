@@ -0,0 +1,61 @@
+import decimal
+
+import pytest
+
+import db
+import wire
+from rows import random_rows
+
+
+@pytest.mark.parametrize("fmt", [wire.FORMAT_JSON, wire.FORMAT_STRUCT])
+def test_roundtrip(fmt):
+    rows = random_rows(500)
+    assert [wire.decode(wire.encode(r, fmt), fmt) for r in rows] == rows
+
+
+def test_struct_is_smaller_than_json():
+    rows = random_rows(100)
+    json_size = sum(len(wire.encode(r, wire.FORMAT_JSON)) for r in rows)
+    struct_size = sum(len(wire.encode(r, wire.FORMAT_STRUCT)) for r in rows)
+    assert struct_size * 2 < json_size
+
+
+def test_struct_rejects_sub_cent_price():
+    row = random_rows(1)[0]
+    row.price = decimal.Decimal("1.005")
+    with pytest.raises(ValueError):
+        wire.encode(row, wire.FORMAT_STRUCT)
+
+
+def test_struct_rejects_trailing_bytes():
+    payload = wire.encode(random_rows(1)[0], wire.FORMAT_STRUCT)
+    with pytest.raises(ValueError):
+        wire.decode(payload + b"\x00", wire.FORMAT_STRUCT)
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        (None, wire.FORMAT_JSON),
+        ((), wire.FORMAT_JSON),
+        ((("other", b"struct"),), wire.FORMAT_JSON),
+        ((("format", b"json"),), wire.FORMAT_JSON),
+        ((("format", b"struct"),), wire.FORMAT_STRUCT),
+        ((("format", b"avro"),), wire.FORMAT_UNKNOWN),
+        ((("format", b"\xff\xfe"),), wire.FORMAT_UNKNOWN),
+        ((("format", b"x" * 1000),), wire.FORMAT_UNKNOWN),
+    ],
+)
+def test_message_format(headers, expected):
+    assert wire.message_format(headers) == expected
+
+
+def test_unknown_format_is_parse_error():
+    row = random_rows(1)[0]
+    records = [
+        (wire.FORMAT_STRUCT, wire.encode(row, wire.FORMAT_STRUCT)),
+        (wire.FORMAT_UNKNOWN, b"whatever"),
+    ]
+    parsed, errors = db.DBProcessor.parse_records(records)
+    assert parsed == [row]
+    assert errors == 1